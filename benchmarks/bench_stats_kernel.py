@@ -0,0 +1,84 @@
+"""
+Benchmark of the yearly station statistics: the vectorized kernel of src/stats_kernel.py against the previous
+pandas implementation (year from a list comprehension over timestamps, rows with any missing value dropped, groupby).
+
+Usage from the repository root:
+    python benchmarks/bench_stats_kernel.py --rows 20000000 --stations 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.stats_kernel import yearlyStationStats
+
+
+def syntheticRows(rows, stations, missing_rate, seed=0):
+    # rows ordered on station then date like weather_data, with missing_rate of each measurement set to -9999
+    rng = np.random.default_rng(seed)
+    per_station = rows // stations
+    station_codes = np.repeat(np.arange(stations), per_station)
+    days = np.tile(np.arange(per_station) + 5479, stations)  # from 1985-01-01
+    columns = {}
+    for name, low, high in (('max_temperature', -100, 350), ('min_temperature', -250, 200), ('precipitation_amount', 0, 300)):
+        values = rng.integers(low, high, size=len(days)).astype(np.int32)
+        values[rng.random(len(days)) < missing_rate] = -9999
+        columns[name] = values
+    station_ids = np.array([f"USC{code:08d}" for code in range(stations)], dtype=object)
+    return station_ids, station_codes, days, columns
+
+
+def previousImplementation(df):
+    # Analysis.analyzeData before the kernel
+    df = df[(df['max_temperature'] != -9999) & (df['min_temperature'] != -9999) & (df['precipitation_amount'] != -9999)].copy()
+    df['year'] = [int(x.year) for x in df['date']]
+    analysis = pd.DataFrame(df.groupby(['year', 'station_id']).agg({'max_temperature': 'mean', 'min_temperature': 'mean', 'precipitation_amount': 'sum'}).reset_index())
+    analysis['max_temperature'] = analysis['max_temperature'] / 10
+    analysis['min_temperature'] = analysis['min_temperature'] / 10
+    analysis['precipitation_amount'] = analysis['precipitation_amount'] / 100
+    return analysis
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the yearly station statistics kernel")
+    parser.add_argument('--rows', type=int, default=20000000, help='number of daily rows')
+    parser.add_argument('--stations', type=int, default=200, help='number of stations')
+    parser.add_argument('--missing_rate', type=float, default=0.05, help='fraction of missing values per measurement')
+    parser.add_argument('--skip_previous', type=bool, default=False, help='only run the kernel : Boolean')
+    parser.add_argument('--output', type=str, required=False, help='write the results as json to this file')
+    args = parser.parse_args()
+
+    station_ids, station_codes, days, columns = syntheticRows(args.rows, args.stations, args.missing_rate)
+    rows = len(days)
+    results = {'benchmark': 'stats_kernel', 'rows': rows, 'stations': args.stations}
+
+    start = time.perf_counter()
+    yearlyStationStats(station_ids, station_codes, days, columns['max_temperature'], columns['min_temperature'], columns['precipitation_amount'])
+    results['kernel_seconds'] = time.perf_counter() - start
+    results['kernel_rows_per_second'] = rows / results['kernel_seconds']
+    print(f"kernel:   {results['kernel_seconds']:.3f} s, {results['kernel_rows_per_second']:,.0f} rows/s")
+
+    if not args.skip_previous:
+        df = pd.DataFrame({'station_id': station_ids[station_codes], 'date': pd.to_datetime(days, unit='D')})
+        for name, values in columns.items():
+            df[name] = values
+        start = time.perf_counter()
+        previousImplementation(df)
+        results['previous_seconds'] = time.perf_counter() - start
+        results['previous_rows_per_second'] = rows / results['previous_seconds']
+        results['speedup'] = results['previous_seconds'] / results['kernel_seconds']
+        print(f"previous: {results['previous_seconds']:.3f} s, {results['previous_rows_per_second']:,.0f} rows/s")
+        print(f"speedup:  {results['speedup']:.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Generate synthetic weather and yield data files in the exact format of wx_data and yld_data:
+
+* wx_data/<station_id>.txt: one line per day, tab separated: date (YYYYMMDD), maximum temperature and minimum
+  temperature in tenths of degrees Celsius, precipitation in tenths of millimeters, -9999 for a missing value
+* yld_data/US_corn_grain_yield.txt: one line per year, tab separated: year, yield
+
+Usage from the repository root:
+    python benchmarks/generate_data.py --output_dir /tmp/bench_data --stations 167 --years 30 --missing_rate 0.02
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def generateWeatherData(directory, stations, years, missing_rate, start_year=1985, seed=0):
+    """
+    Write one station file per station into directory/wx_data.
+    :return: number of rows written
+    """
+    rng = np.random.default_rng(seed)
+    weather_path = os.path.join(directory, 'wx_data')
+    os.makedirs(weather_path, exist_ok=True)
+    dates = pd.date_range(f"{start_year}-01-01", f"{start_year + years - 1}-12-31", freq='D')
+    # seasonal temperature curve, coldest in January
+    season = -np.cos(2 * np.pi * (dates.dayofyear.to_numpy() - 15) / 365.25)
+    date_strings = dates.strftime('%Y%m%d').to_numpy()
+    rows = 0
+    for station in range(stations):
+        offset = rng.normal(0, 30)
+        max_temperature = (150 + offset + 150 * season + rng.normal(0, 40, len(dates))).astype(np.int32)
+        min_temperature = max_temperature - rng.integers(50, 150, len(dates))
+        precipitation = np.where(rng.random(len(dates)) < 0.3, rng.exponential(80, len(dates)), 0).astype(np.int32)
+        values = np.column_stack([max_temperature, min_temperature, precipitation])
+        values[rng.random(values.shape) < missing_rate] = -9999
+        frame = pd.DataFrame({'date': date_strings, 'max_temperature': values[:, 0], 'min_temperature': values[:, 1], 'precipitation_amount': values[:, 2]})
+        frame.to_csv(os.path.join(weather_path, f"USC{station:08d}.txt"), sep='\t', header=False, index=False)
+        rows += len(frame)
+    return rows
+
+
+def generateYieldData(directory, years, start_year=1985, seed=0):
+    """
+    Write the yearly yield file into directory/yld_data.
+    :return: number of rows written
+    """
+    rng = np.random.default_rng(seed)
+    yield_path = os.path.join(directory, 'yld_data')
+    os.makedirs(yield_path, exist_ok=True)
+    frame = pd.DataFrame({'year': np.arange(start_year, start_year + years), 'value': rng.integers(200000, 400000, years)})
+    frame.to_csv(os.path.join(yield_path, 'US_corn_grain_yield.txt'), sep='\t', header=False, index=False)
+    return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic wx_data and yld_data directories")
+    parser.add_argument('--output_dir', type=str, required=True, help='directory where wx_data and yld_data are created')
+    parser.add_argument('--stations', type=int, default=167, help='number of weather stations')
+    parser.add_argument('--years', type=int, default=30, help='number of years per station')
+    parser.add_argument('--missing_rate', type=float, default=0.02, help='fraction of missing values per measurement')
+    parser.add_argument('--start_year', type=int, default=1985, help='first year of the data')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed generates the same files')
+    args = parser.parse_args()
+    rows = generateWeatherData(args.output_dir, args.stations, args.years, args.missing_rate, args.start_year, args.seed)
+    generateYieldData(args.output_dir, args.years, args.start_year, args.seed)
+    print(f"{rows} weather rows written to {os.path.join(args.output_dir, 'wx_data')}")
+
+
+if __name__ == '__main__':
+    main()
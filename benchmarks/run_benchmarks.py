@@ -0,0 +1,156 @@
+"""
+Benchmark suite of the ingestion pipeline and the API, run against a throwaway database.
+
+A new database is created on the given Postgres server, loaded with synthetic data generated by generate_data.py,
+benchmarked and dropped. Results are written as json so they can be compared between releases.
+
+* parse: DataOperations.createWeatherData over the generated wx_data directory
+* insert: InsertData.insertData, first load and re-run with nothing new
+* stats: Analysis.insertStatsData over all the data
+* api: p50/p99 latency of the /api/weather endpoints through the Flask test client, response cache disabled
+
+Usage from the repository root:
+    python benchmarks/run_benchmarks.py --host localhost --user postgres --password admin123 --stations 50 --years 10
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import psycopg2
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_path)
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+from generate_data import generateWeatherData, generateYieldData
+
+
+def timed(results, name, function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    results[name] = time.perf_counter() - start
+    print(f"{name}: {results[name]:.3f} s")
+    return value
+
+
+def latency(client, name, urls, results):
+    # latency of every url in milliseconds, summarized as percentiles
+    timings = []
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, f"{url} returned {response.status_code}"
+    results[name] = {'requests': len(timings), 'p50_ms': float(np.percentile(timings, 50)), 'p99_ms': float(np.percentile(timings, 99))}
+    print(f"{name}: p50 {results[name]['p50_ms']:.2f} ms, p99 {results[name]['p99_ms']:.2f} ms")
+
+
+def writeConfig(path, args, database, snapshot_path):
+    config = configparser.ConfigParser()
+    config['database'] = {'host': args.host, 'port': str(args.port), 'database': database, 'user': args.user, 'password': args.password}
+    config['pool'] = {'min_size': '1', 'max_size': '4', 'timeout': '30'}
+    config['cache'] = {'enabled': 'false'}
+    config['columnar'] = {'path': snapshot_path, 'serve_stats': 'false'}
+    with open(path, 'w') as file:
+        config.write(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline and the API on a throwaway database")
+    parser.add_argument('--host', type=str, default='localhost', help='Postgres server host')
+    parser.add_argument('--port', type=int, default=5432, help='Postgres server port')
+    parser.add_argument('--user', type=str, default='postgres', help='user allowed to create databases')
+    parser.add_argument('--password', type=str, default='', help='password of the user')
+    parser.add_argument('--stations', type=int, default=50, help='number of generated weather stations')
+    parser.add_argument('--years', type=int, default=10, help='number of generated years per station')
+    parser.add_argument('--missing_rate', type=float, default=0.02, help='fraction of missing values per measurement')
+    parser.add_argument('--workers', type=int, required=False, help='number of processes parsing the data files')
+    parser.add_argument('--requests', type=int, default=200, help='number of requests per API benchmark')
+    parser.add_argument('--output', type=str, required=False, help='json results file, defaults to benchmarks/results/<timestamp>.json')
+    args = parser.parse_args()
+
+    work_path = tempfile.mkdtemp(prefix='crop_bench_')
+    database = f"crop_bench_{os.getpid()}"
+    admin = psycopg2.connect(host=args.host, port=args.port, dbname='postgres', user=args.user, password=args.password)
+    admin.autocommit = True
+    admin.cursor().execute(f'CREATE DATABASE "{database}"')
+    config_path = os.path.join(work_path, 'CONFIG.ini')
+    writeConfig(config_path, args, database, os.path.join(work_path, 'snapshot'))
+    # the application modules read their configuration and set up logging when they are imported
+    os.environ['CROP_WEATHER_CONFIG'] = config_path
+    logging.basicConfig(filename=os.path.join(work_path, 'bench.log'), level=logging.INFO)
+    # createTable reads its sql files from the src directory
+    os.chdir(os.path.join(repo_path, 'src'))
+
+    try:
+        from src.data_operations import DataOperations, InsertData
+        from src.analyze import Analysis
+        from service import app
+
+        results = {}
+        rows = generateWeatherData(work_path, args.stations, args.years, args.missing_rate)
+        generateYieldData(work_path, args.years)
+        weather_path = os.path.join(work_path, 'wx_data')
+        yield_path = os.path.join(work_path, 'yld_data')
+
+        dataop = DataOperations(args.workers, weather_path, yield_path)
+        timed(results, 'parse_weather_seconds', dataop.createWeatherData)
+
+        ins = InsertData(args.workers)
+        ins.dataop = dataop
+        timed(results, 'insert_weather_seconds', ins.insertData, ins.weather_table_name)
+        timed(results, 'insert_weather_rerun_seconds', ins.insertData, ins.weather_table_name)
+        timed(results, 'insert_yield_seconds', ins.insertData, ins.yield_table_name)
+        ins.db.cursor.execute("SELECT COUNT(*) FROM weather_data")
+        assert ins.db.cursor.fetchone()[0] == rows, "weather_data does not contain every generated row"
+        ins.db.close()
+
+        analysis = Analysis()
+        timed(results, 'stats_seconds', analysis.insertStatsData)
+        analysis.db.close()
+
+        rng = np.random.default_rng(0)
+        stations = [f"USC{code:08d}" for code in rng.integers(0, args.stations, args.requests)]
+        years = rng.integers(1985, 1985 + args.years, args.requests)
+        pages = rng.integers(1, max(2, rows // 20), args.requests)
+        client = app.test_client()
+        latency(client, 'api_weather_page', [f"/api/weather?page_number={page}" for page in pages], results)
+        latency(client, 'api_weather_station_range', [f"/api/weather?station_id={s}&start_date={y}-03-01&end_date={y}-09-30" for s, y in zip(stations, years)], results)
+        latency(client, 'api_weather_cursor', [f"/api/weather?station_id={s}&cursor=" for s in stations], results)
+        latency(client, 'api_stats_station', [f"/api/weather/stats?station_id={s}" for s in stations], results)
+        latency(client, 'api_stats_partial_year', [f"/api/weather/stats?start_date={y}-04-01&end_date={y}-10-31" for y in years], results)
+    finally:
+        import src.db_conn
+        if src.db_conn.connection_pool is not None:
+            src.db_conn.connection_pool.closeall()
+        admin.cursor().execute(f'DROP DATABASE IF EXISTS "{database}"')
+        admin.close()
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo_path, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'parameters': {'stations': args.stations, 'years': args.years, 'missing_rate': args.missing_rate, 'workers': args.workers,
+                       'requests': args.requests, 'weather_rows': rows},
+        'results': results,
+    }
+    output = args.output or os.path.join(repo_path, 'benchmarks', 'results', f"{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
+import csv
+import io
 import json
+import time
+from functools import wraps
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import pandas as pd
 from flask_swagger import swagger
 import flask_swagger_ui
 import psycopg2
-from src.data_operations import FetchData
+from src.data_operations import FetchData, BatchFetchData, fetchYieldWeather
 from src.db_conn import Database
+from src.cache import createResponseCache
+from src.catalog import StationCatalog, totalPages
+from src.metrics import metrics
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -27,6 +34,67 @@ swagger_blueprint = flask_swagger_ui.get_swaggerui_blueprint(
 
 app.register_blueprint(swagger_blueprint, url_prefix=Swagger_URL)
 
+# cache of the serialized responses, None when disabled in CONFIG.ini
+response_cache = createResponseCache()
+# maximum number of specs answered by one /api/weather/batch request
+batch_max_specs = 1000
+
+
+def get_db():
+    """
+    :return: pooled database connection of the current request, checked out on first use
+    """
+    if 'db' not in g:
+        g.db = Database()
+    return g.db
+
+
+@app.teardown_appcontext
+def release_db(exception):
+    # return the connection of the request to the pool
+    db = g.pop('db', None)
+    if db is not None:
+        db.close()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    # latency per route, a streamed export is measured until its first byte is ready
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('crop_weather_http_request_seconds', {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)},
+                        time.perf_counter() - start)
+    return response
+
+
+def cached_response(view):
+    """
+    Serve the response of a GET endpoint from the response cache when the same query was answered before.
+    Only successful responses are stored, with their body, mimetype and X- headers.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if response_cache is None:
+            return view(*args, **kwargs)
+        key = response_cache.key(request.path, request.args.to_dict(), {'page_size': '20', 'page_number': '1'})
+        generation = response_cache.generation()
+        cached = response_cache.get(key, generation)
+        if cached is not None:
+            entry = json.loads(cached)
+            return Response(entry['body'], mimetype=entry['mimetype'], headers=entry['headers'])
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            headers = {name: value for name, value in response.headers.items() if name.startswith('X-')}
+            response_cache.set(key, json.dumps({'body': response.get_data(as_text=True), 'mimetype': response.mimetype, 'headers': headers}), generation)
+        return response
+    return wrapper
+
 
 @app.route('/swagger.json')
 def swagger_json():
@@ -36,6 +104,7 @@ def swagger_json():
 
 
 @app.route("/api/weather", methods=['GET'])
+@cached_response
 def get_weather_data():
     # Set default page size and page number
     pageSize = 20  # LIMIT
@@ -52,9 +121,17 @@ def get_weather_data():
 
     if 'page_number' in args:
         pageNumber = args.get('page_number')
+    # cursor pagination is used when a cursor is given, an empty cursor starts from the first page
+    cursor = args.get('cursor')
+    # the total number of rows is returned on the first page, and on the other pages only with with_total=true
+    with_total = args.get('with_total', '').lower() in ('1', 'true')
     # Fetch data from external module using provided request parameters
-    fd = FetchData(start_date, end_date, station_id, pageSize, pageNumber)
-    data = fd.fetchData()
+    fd = FetchData(start_date, end_date, station_id, pageSize, pageNumber, cursor, db=get_db(), with_total=with_total)
+    try:
+        data = fd.fetchData()
+    except ValueError as e:
+        resp = {'status': 'error', 'message': str(e)}
+        return json.dumps(resp), 400
     # Convert fetched data to JSON format
     data['date'] = pd.to_datetime(data['date'], errors='coerce')
     data['date'] = data['date'].dt.strftime('%Y-%m-%d')
@@ -63,11 +140,20 @@ def get_weather_data():
     if not res:
         resp = {'status': 'success', 'message': '0 records found'}
         return json.dumps(resp)
+    # token to fetch the page after this one, None on the last page
+    headers = {'X-Next-Cursor': fd.next_cursor} if fd.next_cursor else {}
+    if fd.total_count is not None:
+        # total number of matching rows and pages, from the station catalog, on the first page or with with_total
+        headers.update({'X-Total-Count': str(fd.total_count), 'X-Total-Pages': str(fd.total_pages)})
+    if cursor is not None:
+        return json.dumps({'data': json.loads(res), 'next_cursor': fd.next_cursor, 'total_count': fd.total_count,
+                           'total_pages': fd.total_pages}), 200, headers
 
-    return res
+    return res, 200, headers
 
 
 @app.route('/api/weather/stats', methods=['GET'])
+@cached_response
 def get_weather_data_stats():
     """
     :return: json result of the statistics on data extracted per user parameters
@@ -87,18 +173,14 @@ def get_weather_data_stats():
     if 'page_number' in args:  # if 'page_number' query parameter is present, overwrite the default value
         pageNum = args.get('page_number')
 
-    fd = FetchData(start_date, end_date, station_id, pageSize, pageNum)
-    data = fd.fetchDataStats()
-    # convert the 'date' column to a datetime format, setting invalid dates to NaT
-    data['date'] = pd.to_datetime(data['date'], errors='coerce')
-    data['year'] = [x.year for x in data['date']]
-    analysis = pd.DataFrame(data.groupby(['year', 'station_id']).agg({'max_temperature': 'mean', 'min_temperature': 'mean', 'precipitation_amount': 'sum'}).reset_index())
-    analysis = analysis.rename(columns={'max_temperature':'avg_max_temperature', 'min_temperature':'avg_min_temperature', 'precipitation_amount': 'total_precipitation_amount'})
-    # convert 'max_temperature' from tenths of degrees Celsius to degrees Celsius
-    analysis['avg_max_temperature'] = analysis['avg_max_temperature'] / 10
-    analysis['avg_min_temperature'] = analysis['avg_min_temperature'] / 10
-    # convert 'precipitation_amount' from tenths of millimeters to centimeters
-    analysis['total_precipitation_amount'] = analysis['total_precipitation_amount'] / 100
+    fd = FetchData(start_date, end_date, station_id, pageSize, pageNum, db=get_db())
+    # statistics are aggregated by the database, or read from weather_data_stats for whole years,
+    # the month, season and window groupings are read from the weather_cumulative prefix sums
+    try:
+        analysis = fd.fetchDataStats(args.get('grouping', 'year'), args.get('season_start'), args.get('season_end'))
+    except ValueError as e:
+        resp = {'status': 'error', 'message': str(e)}
+        return json.dumps(resp), 400
     # convert the analysis DataFrame to JSON format with records orientation
     res = analysis.to_json(orient='records')
 
@@ -108,3 +190,128 @@ def get_weather_data_stats():
     # return the JSON response
     return jsonify(res)
 
+
+@app.route('/api/weather/export', methods=['GET'])
+def export_weather_data():
+    """
+    Stream all the weather data matching the start_date, end_date and station_id parameters, without pagination.
+    Rows are read from a server side cursor and written out batch by batch, so memory use does not grow with the result.
+    :return: streamed response in NDJSON (format=ndjson, default) or CSV (format=csv)
+    """
+    args = request.args.to_dict()
+    output_format = args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        resp = {'status': 'error', 'message': 'format must be ndjson or csv'}
+        return json.dumps(resp), 400
+    fd = FetchData(args.get('start_date'), args.get('end_date'), args.get('station_id'), db=get_db())
+    columns = ['station_id', 'date', 'max_temperature', 'min_temperature', 'precipitation_amount']
+
+    def generate():
+        if output_format == 'csv':
+            yield ','.join(columns) + '\n'
+        for rows in fd.streamData():
+            buffer = io.StringIO()
+            if output_format == 'csv':
+                csv.writer(buffer, lineterminator='\n').writerows((station_id, date.strftime('%Y-%m-%d'), max_t, min_t, precipitation)
+                                                                   for station_id, date, max_t, min_t, precipitation in rows)
+            else:
+                for station_id, date, max_t, min_t, precipitation in rows:
+                    buffer.write(json.dumps({'station_id': station_id, 'date': date.strftime('%Y-%m-%d'), 'max_temperature': max_t,
+                                             'min_temperature': min_t, 'precipitation_amount': precipitation}) + '\n')
+            yield buffer.getvalue()
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    # stream_with_context keeps the request, and its pooled connection, alive until the last row is sent
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+@app.route('/api/weather/batch', methods=['POST'])
+def get_weather_data_batch():
+    """
+    Answer a list of {station_id, start_date, end_date} specs in one request and one SQL query.
+    The json body is {specs: [...], mode: stats (default) or raw, page_size: 20, page_number: 1}.
+    :return: json with one result per spec, in the order of the specs
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        resp = {'status': 'error', 'message': 'the request body must be a json object'}
+        return json.dumps(resp), 400
+    specs = body.get('specs')
+    if isinstance(specs, list) and len(specs) > batch_max_specs:
+        resp = {'status': 'error', 'message': f'at most {batch_max_specs} specs per request'}
+        return json.dumps(resp), 400
+    try:
+        # the specs are validated before a connection is taken from the pool
+        fd = BatchFetchData(specs, body.get('mode', 'stats'), body.get('page_size', 20), body.get('page_number', 1))
+        fd.db = get_db()
+        results = fd.fetchBatch()
+    except ValueError as e:
+        resp = {'status': 'error', 'message': str(e)}
+        return json.dumps(resp), 400
+    return jsonify({'results': results})
+
+
+@app.route('/api/yield/weather', methods=['GET'])
+@cached_response
+def get_yield_weather():
+    """
+    :return: json with the crop yield and the weather averaged over all the stations per year, and the correlation
+        of the yield with each weather measurement across the years
+    """
+    args = request.args.to_dict()
+    try:
+        start_year = int(args['start_year']) if args.get('start_year') else None
+        end_year = int(args['end_year']) if args.get('end_year') else None
+    except ValueError:
+        resp = {'status': 'error', 'message': 'start_year and end_year must be integers'}
+        return json.dumps(resp), 400
+    # read from the materialized views, the join and the correlations are not computed per request
+    years, correlations = fetchYieldWeather(get_db(), start_year, end_year)
+    if years.empty:
+        resp = {'status': 'success', 'message': '0 records found'}
+        return json.dumps(resp)
+    return json.dumps({'years': json.loads(years.to_json(orient='records')), 'correlations': json.loads(correlations.to_json(orient='records'))})
+
+
+@app.route('/api/stations', methods=['GET'])
+@cached_response
+def get_stations():
+    """
+    :return: json list of the weather stations with their first and last date, number of rows and rows per year,
+        read from the station catalog
+    """
+    args = request.args.to_dict()
+    try:
+        page_size = int(args.get('page_size', 20))
+        page_number = int(args.get('page_number', 1))
+    except ValueError:
+        resp = {'status': 'error', 'message': 'page_size and page_number must be integers'}
+        return json.dumps(resp), 400
+    if page_size < 0 or page_number < 1:
+        resp = {'status': 'error', 'message': 'page_size must be at least 0 and page_number at least 1'}
+        return json.dumps(resp), 400
+    catalog = StationCatalog(get_db())
+    if not catalog.ready():
+        resp = {'status': 'success', 'message': '0 records found'}
+        return json.dumps(resp)
+    stations, total_count = catalog.listStations(page_size, page_number)
+    headers = {'X-Total-Count': str(total_count), 'X-Total-Pages': str(totalPages(total_count, page_size))}
+    return stations.to_json(orient='records'), 200, headers
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """
+    :return: json with the hit and miss counters of the response cache
+    """
+    if response_cache is None:
+        return jsonify({'status': 'success', 'message': 'response cache disabled'})
+    return jsonify(response_cache.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    :return: request latency histograms, SQL timings and pipeline stage timings of this process in the Prometheus text format
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,3 @@
+DELETE FROM yield_data a USING yield_data b WHERE a.ctid < b.ctid AND a.year = b.year
+DELETE FROM weather_data a USING weather_data b WHERE a.ctid < b.ctid AND a.station_id = b.station_id AND a.date = b.date
+DO $$ BEGIN IF to_regclass('weather_data_stats') IS NOT NULL THEN DELETE FROM weather_data_stats a USING weather_data_stats b WHERE a.ctid < b.ctid AND a.year = b.year AND a.station_id = b.station_id; END IF; END $$
\ No newline at end of file
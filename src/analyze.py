@@ -5,23 +5,52 @@ import psycopg2
 import numpy as np
 import os
 import time
-from db_conn import Database
-from data_operations import FetchData
+# imported through the src package like data_operations, so a process has one copy of each module and one connection pool
+from src.cache import invalidateCache
+from src.columnar import ColumnarSnapshot
+from src.db_conn import Database
+from src.stats_kernel import yearlyStationStats
+from src.data_operations import FetchData
+from src.metrics import stageTimer
 
 
 class Analysis:
-    def __init__(self):
+    def __init__(self, use_snapshot=False):
+        """
+        :param use_snapshot: read the weather data from the local columnar snapshot instead of the database
+            when analyzing all the years and stations
+        """
         # create Database instance to create database connection and cursor instance
         self.db = Database()
+        self.snapshot = ColumnarSnapshot() if use_snapshot else None
         self.weather_table_name = 'weather_data'
         self.fetch_queries = {
-            self.weather_table_name: f"SELECT * FROM {self.weather_table_name} WHERE 1=1",
+            self.weather_table_name: f"SELECT station_id, date - DATE '1970-01-01' AS day, max_temperature, min_temperature, precipitation_amount FROM {self.weather_table_name} WHERE 1=1",
         }
         self.create_table = f"CREATE TABLE IF NOT EXISTS weather_data_stats (year integer, station_id varchar(100), avg_max_temperature float, avg_min_temperature float, total_precipitation_amount float)"
-        self.insert_query = f"INSERT INTO weather_data_stats (year, station_id, avg_max_temperature, avg_min_temperature, total_precipitation_amount) VALUES (%s, %s, %s, %s, %s)"
-        self.duplicate_check = f"SELECT EXISTS(SELECT 1 FROM weather_data_stats WHERE year=%s AND station_id=%s AND avg_max_temperature=%s AND avg_min_temperature=%s AND total_precipitation_amount=%s )"
+        self.create_index = f"CREATE UNIQUE INDEX IF NOT EXISTS weather_data_stats_year_station_key ON weather_data_stats (year, station_id)"
+        self.stats_columns = ['year', 'station_id', 'avg_max_temperature', 'avg_min_temperature', 'total_precipitation_amount']
+        self.key_columns = ['year', 'station_id']
+        # yearly crop yield next to the weather of that year averaged over all the stations, and the correlation of the
+        # yield with each weather measurement across the years, built from weather_data_stats instead of the daily rows.
+        # The unique indexes are required to refresh the views concurrently, while the API keeps reading them.
+        self.yield_weather_views = [
+            ("yield_weather_yearly",
+             "CREATE MATERIALIZED VIEW IF NOT EXISTS yield_weather_yearly AS SELECT y.year, y.value AS yield_value, "
+             "AVG(s.avg_max_temperature) AS avg_max_temperature, AVG(s.avg_min_temperature) AS avg_min_temperature, "
+             "AVG(s.total_precipitation_amount) AS avg_total_precipitation_amount, COUNT(s.station_id) AS station_count "
+             "FROM yield_data y JOIN weather_data_stats s ON s.year = y.year GROUP BY y.year, y.value WITH NO DATA",
+             "CREATE UNIQUE INDEX IF NOT EXISTS yield_weather_yearly_year_key ON yield_weather_yearly (year)"),
+            ("yield_weather_correlation",
+             "CREATE MATERIALIZED VIEW IF NOT EXISTS yield_weather_correlation AS SELECT m.metric, "
+             "corr(y.yield_value, m.value) AS correlation, regr_slope(y.yield_value, m.value) AS slope, "
+             "regr_count(y.yield_value, m.value) AS years FROM yield_weather_yearly y "
+             "CROSS JOIN LATERAL (VALUES ('avg_max_temperature', y.avg_max_temperature), ('avg_min_temperature', y.avg_min_temperature), "
+             "('avg_total_precipitation_amount', y.avg_total_precipitation_amount)) AS m(metric, value) GROUP BY m.metric WITH NO DATA",
+             "CREATE UNIQUE INDEX IF NOT EXISTS yield_weather_correlation_metric_key ON yield_weather_correlation (metric)"),
+        ]
 
-    def analyzeData(self):
+    def analyzeData(self, groups=None):
         """
         For every year, for every weather station, calculate:
 
@@ -29,55 +58,89 @@ class Analysis:
         * Average minimum temperature (in degrees Celsius)  data/10
         * Total accumulated precipitation (in centimeters) data/100  10*mm -> /10 -> /10 -> cm
 
-        Ignore missing data when calculating these statistics.
+        Ignore missing data when calculating these statistics, each measurement only ignores its own missing values.
+        :param groups: list of (year, station_id) pairs to analyze, all the weather data is analyzed if not given
         :return: dataframe after analysis
         """
-        self.fetch_queries[self.weather_table_name] += f" AND max_temperature != -9999 "
-        self.fetch_queries[self.weather_table_name] += f" AND min_temperature != -9999 "
-        self.fetch_queries[self.weather_table_name] += f" AND precipitation_amount != -9999 "
-        df = pd.read_sql(self.fetch_queries[self.weather_table_name], self.db.conn)
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df['year'] = [int(x.year) for x in df['date']]
-        analysis = pd.DataFrame(df.groupby(['year', 'station_id']).agg({'max_temperature': 'mean', 'min_temperature': 'mean', 'precipitation_amount': 'sum'}).reset_index())
-        analysis['max_temperature'] = analysis['max_temperature']/10
-        analysis['min_temperature'] = analysis['min_temperature'] / 10
-        analysis['precipitation_amount'] = analysis['precipitation_amount'] / 100
-        return analysis
+        if groups is None and self.snapshot is not None:
+            # computed from the memory mapped snapshot, without reading weather_data from the database, if there is one
+            analysis = self.snapshot.yearlyStats()
+            if analysis is not None:
+                return analysis
+        query = self.fetch_queries[self.weather_table_name]
+        params = None
+        if groups is not None:
+            # only read the rows of the requested years and stations, each group is a range scan on (station_id, date)
+            query = (f"SELECT w.station_id, w.date - DATE '1970-01-01' AS day, w.max_temperature, w.min_temperature, w.precipitation_amount "
+                     f"FROM {self.weather_table_name} w "
+                     f"JOIN unnest(%s::integer[], %s::varchar[]) AS g(year, station_id) ON w.station_id = g.station_id "
+                     f"AND w.date >= make_date(g.year, 1, 1) AND w.date < make_date(g.year + 1, 1, 1) WHERE 1=1")
+            params = [[int(year) for year, station_id in groups], [station_id for year, station_id in groups]]
+        df = pd.read_sql(query, self.db.conn, params=params)
+        # dates are read as days since 1970-01-01 and missing values are handled per measurement by the kernel
+        station_codes, stations = pd.factorize(df['station_id'], sort=True)
+        return yearlyStationStats(stations, station_codes, df['day'].to_numpy(), df['max_temperature'].to_numpy(),
+                                  df['min_temperature'].to_numpy(), df['precipitation_amount'].to_numpy())
 
-    def insertStatsData(self):
+    def insertStatsData(self, groups=None):
+        """
+        Compute the statistics and upsert them into weather_data_stats, one row per year and station.
+        :param groups: list of (year, station_id) pairs to refresh, e.g. InsertData.touched_groups after a load.
+            All the years and stations are recomputed if not given.
+        :return: None
+        """
+        if groups is not None and not groups:
+            logging.info("No new weather data, statistics in [weather_data_stats] are up to date")
+            return
         # Execute SQL query to create table for statistics data
         self.db.cursor.execute(self.create_table)
+        self.db.cursor.execute(self.create_index)
         # Analyze weather data to create statistics
-        data = self.analyzeData()
+        with stageTimer('aggregate', 'weather_data_stats'):
+            data = self.analyzeData(groups)
         start_time = time.time()
         logging.info(f"Data ingestion process started at {start_time}")
         try:
-            # Create an empty list to store non-duplicate rows
-            res = []
-            for idx, row in data.iterrows():
-                # Execute SQL query to check for duplicates
-                self.db.cursor.execute(self.duplicate_check, tuple(row))
-                # If no duplicate is found, add the row to the list of non-duplicates
-                if not self.db.cursor.fetchone()[0]:
-                    res.append(tuple(row))
-            # Count number of non-duplicates
-            records = len(res)
-            if len(res) > 0:
-                # If there are non-duplicates, insert them into the table
-                self.db.cursor.executemany(self.insert_query, res)
-            else:
-                records = 0
+            # Bulk load the statistics, the row of a year and station already in the table is replaced if its values changed
+            records = self.db.bulkMerge('weather_data_stats', self.stats_columns, data, self.key_columns, update_changed=True)
             # Commit changes to the database
-            self.db.conn.commit()
+            with stageTimer('commit', 'weather_data_stats'):
+                self.db.conn.commit()
+            if records:
+                # cached API responses may contain the old statistics
+                invalidateCache()
             end_time = time.time()
             # Log end time and number of non-duplicates inserted into the table
             logging.info(f"Data ingestion process ended at {end_time}. Number of non duplicate records ingested into the table [weather_data_stats] : {records}")
 
         except Exception as e:
-            # If an error occurs during data ingestion, log the error
+            # If an error occurs during data ingestion, rollback the transaction and log the error
+            self.db.conn.rollback()
             logging.info(f"Error {e} occurred at {start_time} while inserting data into [weather_data_stats]")
 
-
-
-
-
+    def refreshYieldWeather(self):
+        """
+        Create the yield and weather materialized views if needed and refresh them, in dependency order.
+        A populated view is refreshed concurrently so the API can read it during the refresh.
+        :return: None
+        """
+        self.db.cursor.execute("SELECT to_regclass('weather_data_stats') IS NOT NULL AND to_regclass('yield_data') IS NOT NULL")
+        if not self.db.cursor.fetchone()[0]:
+            logging.info("Yield and weather views not refreshed, [weather_data_stats] or [yield_data] does not exist yet")
+            return
+        try:
+            for view_name, create_view, create_index in self.yield_weather_views:
+                self.db.cursor.execute(create_view)
+                self.db.cursor.execute(create_index)
+                self.db.cursor.execute("SELECT ispopulated FROM pg_matviews WHERE matviewname = %s", (view_name,))
+                # CONCURRENTLY is only allowed once the view holds data
+                concurrently = "CONCURRENTLY " if self.db.cursor.fetchone()[0] else ""
+                with stageTimer('refresh', view_name):
+                    self.db.cursor.execute(f"REFRESH MATERIALIZED VIEW {concurrently}{view_name}")
+            self.db.conn.commit()
+            # cached API responses may contain the old views
+            invalidateCache()
+            logging.info("Materialized views [yield_weather_yearly] and [yield_weather_correlation] refreshed")
+        except Exception as e:
+            self.db.conn.rollback()
+            logging.info(f"Error {e} occurred while refreshing the yield and weather views")
@@ -0,0 +1,179 @@
+import configparser
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+try:
+    import redis
+except ImportError:  # the shared backend is optional, the local cache works without it
+    redis = None
+
+config = configparser.ConfigParser()
+config.read(os.environ.get('CROP_WEATHER_CONFIG', 'src/CONFIG.ini'))
+
+cache_enabled = config.getboolean('cache', 'enabled', fallback=True)
+cache_backend = config.get('cache', 'backend', fallback='local')
+cache_max_entries = config.getint('cache', 'max_entries', fallback=1024)
+cache_ttl = config.getint('cache', 'ttl', fallback=300)
+cache_redis_url = config.get('cache', 'redis_url', fallback='redis://localhost:6379/0')
+cache_prefix = 'weather_api:'
+# touched after every ingestion, processes on the same host compare its modification time to drop stale entries
+generation_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache_generation')
+
+
+class LocalCache:
+    def __init__(self, max_entries, ttl):
+        """
+        In process cache with least recently used eviction and a time to live, used when no shared backend is set.
+        :param max_entries: maximum number of responses kept, the least recently used one is evicted first
+        :param ttl: number of seconds a response is kept
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = None
+
+    def get(self, key, generation):
+        with self.lock:
+            if generation != self.generation:
+                # new data was ingested since the entries were stored
+                self.entries.clear()
+                self.generation = generation
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def size(self):
+        return len(self.entries)
+
+
+class RedisCache:
+    def __init__(self, url, ttl):
+        """
+        Cache shared by all the workers of a deployment. Memory is bounded by the server maxmemory setting,
+        configure it with maxmemory-policy allkeys-lru for least recently used eviction.
+        :param url: redis connection url
+        :param ttl: number of seconds a response is kept
+        """
+        if redis is None:
+            raise ImportError("The redis package is required for the redis cache backend")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key, generation):
+        value = self.client.get(f"{cache_prefix}{generation}:{key}")
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, generation):
+        self.client.set(f"{cache_prefix}{generation}:{key}", value, ex=self.ttl)
+
+    def size(self):
+        return None
+
+    def generation(self):
+        return int(self.client.get(f"{cache_prefix}generation") or 0)
+
+    def bump(self):
+        # entries of older generations are never read again and expire with their ttl
+        self.client.incr(f"{cache_prefix}generation")
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        """
+        Cache of serialized API responses keyed on the endpoint and its normalized query parameters,
+        with hit and miss counters.
+        :param backend: LocalCache or RedisCache instance
+        """
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def generation(self):
+        # version of the data, changes every time an ingestion commits new rows
+        if isinstance(self.backend, RedisCache):
+            return self.backend.generation()
+        try:
+            return os.stat(generation_file).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def key(self, endpoint, args, defaults=None):
+        """
+        Build the cache key of a request, so that equivalent requests share the same entry.
+        :param endpoint: request path
+        :param args: query parameters of the request
+        :param defaults: default values of the parameters, a parameter given with its default value is the same request
+        :return: cache key
+        """
+        params = dict(defaults or {})
+        for name, value in args.items():
+            # values are kept as sent, FetchData queries with them unchanged so ' X' and 'X' are different requests.
+            # FetchData treats empty and 'None' filters as not given, an empty cursor however starts cursor pagination
+            if value in ('', 'None') and name != 'cursor':
+                continue
+            params[name] = value
+        return f"{endpoint}?{urlencode(sorted(params.items()))}"
+
+    def get(self, key, generation):
+        """
+        :param key: cache key built by the key method
+        :param generation: data generation read before the request was served
+        :return: cached value or None
+        """
+        value = self.backend.get(key, generation)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, generation):
+        # stored under the generation read before the response was built, so data ingested meanwhile is not masked
+        self.backend.set(key, value, generation)
+
+    def stats(self):
+        return {'backend': type(self.backend).__name__, 'hits': self.hits, 'misses': self.misses, 'entries': self.backend.size()}
+
+
+def createResponseCache():
+    # Creates the response cache from the [cache] section of CONFIG.ini, None if caching is disabled
+    if not cache_enabled:
+        return None
+    if cache_backend == 'redis':
+        return ResponseCache(RedisCache(cache_redis_url, cache_ttl))
+    return ResponseCache(LocalCache(cache_max_entries, cache_ttl))
+
+
+def invalidateCache():
+    # Marks the cached responses of every process as stale, called after an ingestion commits new data
+    now = time.time_ns()
+    with open(generation_file, 'a'):
+        os.utime(generation_file, ns=(now, now))
+    if cache_enabled and cache_backend == 'redis' and redis is not None:
+        try:
+            RedisCache(cache_redis_url, cache_ttl).bump()
+        except redis.RedisError as e:
+            logging.info(f"Error {e} occurred while invalidating the shared response cache")
@@ -0,0 +1,144 @@
+import datetime
+import math
+
+import pandas as pd
+from psycopg2 import errors
+
+# bounds of the year filter when a side of the date range is open
+first_year_bound = -1000000
+last_year_bound = 1000000
+
+
+class StationCatalog:
+    def __init__(self, db):
+        """
+        Coverage of every weather station stored in the station_catalog table: first and last date, number of rows
+        and number of rows per year. It answers whether a station or date range has any data, and the total number of
+        rows of a query, without scanning weather_data.
+        :param db: Database instance used to read and write the catalog
+        """
+        self.db = db
+        self.upsert_query = (
+            "INSERT INTO station_catalog AS t (station_id, first_date, last_date, row_count, year_counts, updated_at) "
+            "SELECT station_id, MIN(first_date), MAX(last_date), SUM(n), jsonb_object_agg(year::text, n), now() FROM ({counts}) y "
+            "GROUP BY station_id ON CONFLICT (station_id) DO UPDATE SET first_date = LEAST(t.first_date, EXCLUDED.first_date), "
+            "last_date = GREATEST(t.last_date, EXCLUDED.last_date), year_counts = t.year_counts || EXCLUDED.year_counts, "
+            "row_count = (SELECT SUM(value::bigint) FROM jsonb_each_text(t.year_counts || EXCLUDED.year_counts)), updated_at = now()")
+
+    def update(self, groups=None):
+        """
+        Recount the given years of the given stations after a load, in the transaction of the load. Not committed.
+        The whole catalog is rebuilt if groups is not given, or if it is still empty while weather_data has rows,
+        e.g. for weather data loaded before the catalog existed.
+        :param groups: (year, station_id) pairs of the weather rows inserted or changed, e.g. InsertData.touched_groups
+        :return: None
+        """
+        if groups is not None:
+            self.db.cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM station_catalog) AND EXISTS (SELECT 1 FROM weather_data)")
+            if self.db.cursor.fetchone()[0]:
+                groups = None
+        if groups is None:
+            self.db.cursor.execute("TRUNCATE station_catalog")
+            counts = ("SELECT station_id, EXTRACT(YEAR FROM date)::integer AS year, COUNT(*) AS n, MIN(date) AS first_date, "
+                      "MAX(date) AS last_date FROM weather_data WHERE date IS NOT NULL GROUP BY 1, 2")
+            self.db.cursor.execute(self.upsert_query.format(counts=counts))
+        elif groups:
+            # each touched year of a station is recounted with a range scan of the (station_id, date) index
+            counts = ("SELECT g.station_id, g.year, COUNT(*) AS n, MIN(w.date) AS first_date, MAX(w.date) AS last_date "
+                      "FROM unnest(%s::integer[], %s::varchar[]) AS g(year, station_id) JOIN weather_data w ON w.station_id = g.station_id "
+                      "AND w.date >= make_date(g.year, 1, 1) AND w.date < make_date(g.year + 1, 1, 1) GROUP BY 1, 2")
+            self.db.cursor.execute(self.upsert_query.format(counts=counts),
+                                   ([int(year) for year, station_id in groups], [station_id for year, station_id in groups]))
+
+    def ready(self):
+        # the catalog is only trusted once it has been built
+        self.db.cursor.execute("SELECT to_regclass('station_catalog') IS NOT NULL")
+        if not self.db.cursor.fetchone()[0]:
+            return False
+        self.db.cursor.execute("SELECT EXISTS (SELECT 1 FROM station_catalog)")
+        return self.db.cursor.fetchone()[0]
+
+    def countRows(self, station_id=None, start_date=None, end_date=None):
+        """
+        Number of rows of weather_data matching the filters. Whole years are summed from the per year counts, and only
+        the partial years at the ends of the date range are counted in weather_data, with a range scan of the index
+        per station, so an unknown station or a range outside the coverage is answered from the catalog alone.
+        The catalog is checked in the same query, so it costs a single round trip.
+        :param station_id: station of the query, all stations if not given
+        :param start_date: first date 'YYYY-MM-DD' of the query, open if not given
+        :param end_date: last date 'YYYY-MM-DD' of the query, open if not given
+        :return: number of rows, None if the catalog is not built yet
+        """
+        start = datetime.datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else None
+        end = datetime.datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else None
+        if start and end and start > end:
+            return 0
+        first_full_year, last_full_year, partial_ranges = splitYears(start, end)
+        # the catalog is only trusted once it has been built, an empty catalog gives a null count
+        query = ("SELECT CASE WHEN EXISTS (SELECT 1 FROM station_catalog) THEN COALESCE(SUM(full_years.n + partial.n), 0) END "
+                 "FROM station_catalog c "
+                 "CROSS JOIN LATERAL (SELECT COALESCE(SUM(value::bigint), 0) AS n FROM jsonb_each_text(c.year_counts) "
+                 "WHERE key::integer BETWEEN %s AND %s) full_years "
+                 "CROSS JOIN LATERAL (SELECT COUNT(*) AS n FROM unnest(%s::date[], %s::date[]) AS r(first_date, last_date) "
+                 "JOIN weather_data w ON w.station_id = c.station_id AND w.date BETWEEN r.first_date AND r.last_date) partial "
+                 "WHERE c.first_date <= COALESCE(%s::date, 'infinity') AND c.last_date >= COALESCE(%s::date, '-infinity')")
+        params = [first_full_year, last_full_year, [r[0] for r in partial_ranges], [r[1] for r in partial_ranges], end, start]
+        if station_id:
+            query += " AND c.station_id = %s"
+            params.append(station_id)
+        try:
+            self.db.cursor.execute(query, params)
+        except errors.UndefinedTable:
+            # database created before the catalog existed
+            self.db.conn.rollback()
+            return None
+        count = self.db.cursor.fetchone()[0]
+        return int(count) if count is not None else None
+
+    def listStations(self, page_size=20, page_number=1):
+        """
+        :param page_size: number of stations to return
+        :param page_number: page of the stations ordered on station_id, the first page is 1
+        :return: tuple (dataframe with the columns station_id, first_date, last_date, row_count, year_counts,
+            total number of stations)
+        """
+        page_size, page_number = int(page_size), int(page_number)
+        stations = pd.read_sql("SELECT station_id, first_date, last_date, row_count, year_counts FROM station_catalog "
+                               "ORDER BY station_id LIMIT %s OFFSET %s", self.db.conn, params=[page_size, (page_number - 1) * page_size])
+        for column in ('first_date', 'last_date'):
+            stations[column] = pd.to_datetime(stations[column]).dt.strftime('%Y-%m-%d')
+        self.db.cursor.execute("SELECT COUNT(*) FROM station_catalog")
+        return stations, self.db.cursor.fetchone()[0]
+
+
+def totalPages(total_count, page_size):
+    # number of pages of page_size rows needed for total_count rows
+    return math.ceil(total_count / page_size) if page_size > 0 else 0
+
+
+def splitYears(start, end):
+    """
+    Split a date range into the whole years counted from the catalog and the partial years counted in weather_data.
+    :param start: first date of the range, open if None
+    :param end: last date of the range, open if None, not before start
+    :return: tuple (first whole year, last whole year, list of (first date, last date) of the partial years)
+    """
+    first_full_year, last_full_year = first_year_bound, last_year_bound
+    partial_ranges = []
+    if start:
+        if (start.month, start.day) == (1, 1):
+            first_full_year = start.year
+        else:
+            first_full_year = start.year + 1
+            year_end = datetime.date(start.year, 12, 31)
+            partial_ranges.append((start, min(year_end, end) if end else year_end))
+    if end:
+        if (end.month, end.day) == (12, 31):
+            last_full_year = end.year
+        else:
+            last_full_year = end.year - 1
+            # a range within a single year is already counted by the partial range of the start
+            if not (partial_ranges and end.year == start.year):
+                year_start = datetime.date(end.year, 1, 1)
+                partial_ranges.append((max(year_start, start) if start else year_start, end))
+    return first_full_year, last_full_year, partial_ranges
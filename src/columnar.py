@@ -0,0 +1,173 @@
+import configparser
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.stats_kernel import yearlyStationStats
+
+config = configparser.ConfigParser()
+config.read(os.environ.get('CROP_WEATHER_CONFIG', 'src/CONFIG.ini'))
+
+# a relative path is taken from the src directory, so the service and the command line scripts use the same snapshot
+snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), config.get('columnar', 'path', fallback='../columnar_snapshot'))
+snapshot_serve_stats = config.getboolean('columnar', 'serve_stats', fallback=False)
+
+# raw little endian arrays of the snapshot, one value per row of weather_data ordered on (station_id, date)
+# date is stored as the number of days since 1970-01-01
+snapshot_columns = {
+    'date': np.dtype('<i4'),
+    'max_temperature': np.dtype('<i2'),
+    'min_temperature': np.dtype('<i2'),
+    'precipitation_amount': np.dtype('<i4'),
+}
+
+
+class ColumnarSnapshot:
+    def __init__(self, path=None):
+        """
+        Local columnar copy of weather_data: one contiguous memory mappable file per column, rows ordered on
+        (station_id, date), and an index.json file giving the offset and number of rows of every station.
+        :param path: directory of the snapshot, defaults to the [columnar] path of CONFIG.ini
+        """
+        self.path = os.path.abspath(path or snapshot_path)
+        self.index_file = os.path.join(self.path, 'index.json')
+        self.loaded_mtime = None
+        self.index = None
+        self.arrays = None
+        self.lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.index_file)
+
+    def build(self, db, chunk_size=1000000):
+        """
+        Dump weather_data from the database into a new snapshot and swap it in place of the current one.
+        The table is exported with COPY into a temporary file, then converted chunk by chunk to the column files.
+        :param db: Database instance used to read weather_data
+        :param chunk_size: number of rows converted at a time
+        :return: number of rows in the snapshot
+        """
+        parent = os.path.dirname(self.path)
+        os.makedirs(parent, exist_ok=True)
+        build_path = tempfile.mkdtemp(prefix='.snapshot_', dir=parent)
+        try:
+            dump_file = os.path.join(build_path, 'dump.csv')
+            with open(dump_file, 'w') as file:
+                db.cursor.copy_expert("COPY (SELECT station_id, date - DATE '1970-01-01', max_temperature, min_temperature, precipitation_amount "
+                                      "FROM weather_data ORDER BY station_id, date) TO STDOUT WITH (FORMAT csv)", file)
+            db.conn.rollback()
+            stations = {}
+            rows = 0
+            outputs = {name: open(os.path.join(build_path, f"{name}.bin"), 'wb') for name in snapshot_columns}
+            try:
+                dtypes = {'station_id': str}
+                dtypes.update(snapshot_columns)
+                for chunk in pd.read_csv(dump_file, names=['station_id'] + list(snapshot_columns), dtype=dtypes, chunksize=chunk_size):
+                    for name, dtype in snapshot_columns.items():
+                        chunk[name].to_numpy(dtype=dtype).tofile(outputs[name])
+                    # rows are ordered on station_id, so a station is one contiguous run that may span two chunks
+                    for station_id, count in chunk.groupby('station_id', sort=False).size().items():
+                        offset, length = stations.get(station_id, (rows, 0))
+                        stations[station_id] = (offset, length + int(count))
+                        rows += int(count)
+            finally:
+                for output in outputs.values():
+                    output.close()
+            os.remove(dump_file)
+            with open(os.path.join(build_path, 'index.json'), 'w') as file:
+                json.dump({'rows': rows, 'built_at': time.time(), 'stations': stations}, file)
+            # swap the new snapshot in, readers holding memory maps of the old files keep working
+            old_path = None
+            if os.path.exists(self.path):
+                old_path = tempfile.mkdtemp(prefix='.snapshot_old_', dir=parent)
+                os.replace(self.path, os.path.join(old_path, 'snapshot'))
+            os.replace(build_path, self.path)
+            if old_path:
+                shutil.rmtree(old_path, ignore_errors=True)
+            return rows
+        except Exception:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+
+    def load(self):
+        """
+        Memory map the column files, reloading them if the snapshot was rebuilt since the last call.
+        :return: tuple (index dict, dict of column name to numpy memmap), None if there is no snapshot
+        """
+        with self.lock:
+            try:
+                mtime = os.stat(self.index_file).st_mtime_ns
+                if mtime != self.loaded_mtime:
+                    with open(self.index_file) as file:
+                        index = json.load(file)
+                    arrays = {}
+                    for name, dtype in snapshot_columns.items():
+                        if index['rows']:
+                            arrays[name] = np.memmap(os.path.join(self.path, f"{name}.bin"), dtype=dtype, mode='r', shape=(index['rows'],))
+                        else:
+                            arrays[name] = np.empty(0, dtype=dtype)
+                    self.index, self.arrays, self.loaded_mtime = index, arrays, mtime
+            except FileNotFoundError:
+                # never built, or between the two renames of a rebuild swapping the directories
+                return None
+            return self.index, self.arrays
+
+    def select(self, station_id=None, start_date=None, end_date=None, snapshot=None):
+        """
+        Get the rows of one or all stations within a date range, without copying the column data.
+        :param station_id: station to select, all stations if not given
+        :param start_date: first date to select 'YYYY-MM-DD', from the first date if not given
+        :param end_date: last date to select 'YYYY-MM-DD', until the last date if not given
+        :param snapshot: (index, arrays) returned by load, loaded if not given
+        :return: list of (station_id, dict of column name to numpy array view), None if there is no snapshot
+        """
+        snapshot = snapshot or self.load()
+        if snapshot is None:
+            return None
+        index, arrays = snapshot
+        stations = index['stations']
+        if station_id is not None:
+            stations = {station_id: stations[station_id]} if station_id in stations else {}
+        start_day = (np.datetime64(start_date, 'D') - np.datetime64('1970-01-01', 'D')).astype(int) if start_date else None
+        end_day = (np.datetime64(end_date, 'D') - np.datetime64('1970-01-01', 'D')).astype(int) if end_date else None
+        selection = []
+        # in file order, so the selected slices line up with the column files
+        for station, (offset, length) in sorted(stations.items(), key=lambda item: item[1][0]):
+            dates = arrays['date'][offset:offset + length]
+            # dates of a station are sorted, the date range is found with a binary search
+            first = int(np.searchsorted(dates, start_day, side='left')) if start_day is not None else 0
+            last = int(np.searchsorted(dates, end_day, side='right')) if end_day is not None else length
+            if first < last:
+                selection.append((station, {name: array[offset + first:offset + last] for name, array in arrays.items()}))
+        return selection
+
+    def yearlyStats(self, station_id=None, start_date=None, end_date=None):
+        """
+        Compute the yearly statistics per station from the snapshot, with the same rules as Analysis.analyzeData.
+        :return: dataframe with the columns year, station_id, max_temperature, min_temperature, precipitation_amount,
+            None if there is no snapshot
+        """
+        # the selection and the columns come from the same load, even if the snapshot is rebuilt meanwhile
+        snapshot = self.load()
+        if snapshot is None:
+            return None
+        index, arrays = snapshot
+        selection = self.select(station_id, start_date, end_date, snapshot)
+        stations = sorted(station for station, columns in selection)
+        codes = {station: code for code, station in enumerate(stations)}
+        lengths = [len(columns['date']) for station, columns in selection]
+        station_codes = np.repeat(np.array([codes[station] for station, columns in selection], dtype=np.int64), lengths)
+        if station_id is None and start_date is None and end_date is None:
+            # the whole snapshot is selected, use the memory maps directly instead of copying the station slices
+            columns = arrays
+        else:
+            columns = {name: np.concatenate([selected[name] for station, selected in selection]) if selection else array[:0]
+                       for name, array in arrays.items()}
+        return yearlyStationStats(np.array(stations, dtype=object), station_codes, columns['date'], columns['max_temperature'],
+                                  columns['min_temperature'], columns['precipitation_amount'])
@@ -1,2 +1,7 @@
 CREATE TABLE IF NOT EXISTS yield_data (year integer, value integer)
-CREATE TABLE IF NOT EXISTS weather_data (station_id varchar(100), date DATE, max_temperature integer, min_temperature integer, precipitation_amount integer)
\ No newline at end of file
+CREATE TABLE IF NOT EXISTS weather_data (station_id varchar(100), date DATE, max_temperature integer, min_temperature integer, precipitation_amount integer)
+CREATE UNIQUE INDEX IF NOT EXISTS yield_data_year_key ON yield_data (year)
+CREATE UNIQUE INDEX IF NOT EXISTS weather_data_station_date_key ON weather_data (station_id, date)
+CREATE TABLE IF NOT EXISTS ingest_manifest (table_name varchar(100), file_name varchar(255), file_size bigint, file_mtime double precision, content_hash varchar(64), last_date DATE, loaded_at timestamp, PRIMARY KEY (table_name, file_name))
+CREATE TABLE IF NOT EXISTS weather_cumulative (station_id varchar(100), date DATE, max_sum bigint, max_count integer, min_sum bigint, min_count integer, precip_sum bigint, precip_count integer, PRIMARY KEY (station_id, date))
+CREATE TABLE IF NOT EXISTS station_catalog (station_id varchar(100) PRIMARY KEY, first_date DATE, last_date DATE, row_count bigint, year_counts jsonb, updated_at timestamp)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import datetime
+
+import pandas as pd
+
+# measurements of weather_data and the prefix of their running sum and valid day count columns in weather_cumulative
+cumulative_metrics = [('max_temperature', 'max'), ('min_temperature', 'min'), ('precipitation_amount', 'precip')]
+
+
+class CumulativeIndex:
+    def __init__(self, db):
+        """
+        Prefix sums of weather_data stored in the weather_cumulative table: for every station and date, the running sum
+        and number of valid days (not -9999) of each measurement over all the rows of the station up to that date.
+        The statistics of any date window of a station are then the difference of two rows, found with two lookups
+        of the (station_id, date) primary key instead of a scan of the daily rows.
+        :param db: Database instance used to read and write the index
+        """
+        self.db = db
+        running = []
+        for column, prefix in cumulative_metrics:
+            running.append(f"b.{prefix}_sum + COALESCE(SUM(NULLIF(w.{column}, -9999)) OVER station_days, 0)")
+            running.append(f"b.{prefix}_count + COUNT(NULLIF(w.{column}, -9999)) OVER station_days")
+        value_columns = [f"{prefix}_{kind}" for column, prefix in cumulative_metrics for kind in ('sum', 'count')]
+        # recompute the running values of each station from the given date onward, starting from the row before it
+        self.update_query = (
+            f"INSERT INTO weather_cumulative AS t (station_id, date, {', '.join(value_columns)}) "
+            f"SELECT w.station_id, w.date, {', '.join(running)} "
+            f"FROM (SELECT s.station_id, s.from_date, {', '.join(f'COALESCE(p.{c}, 0) AS {c}' for c in value_columns)} "
+            f"FROM unnest(%s::varchar[], %s::date[]) AS s(station_id, from_date) "
+            f"LEFT JOIN LATERAL (SELECT * FROM weather_cumulative c WHERE c.station_id = s.station_id AND c.date < s.from_date "
+            f"ORDER BY c.date DESC LIMIT 1) p ON true) b "
+            f"JOIN weather_data w ON w.station_id = b.station_id AND w.date >= b.from_date "
+            f"WINDOW station_days AS (PARTITION BY w.station_id ORDER BY w.date) "
+            f"ON CONFLICT (station_id, date) DO UPDATE SET ({', '.join(value_columns)}) = ROW({', '.join(f'EXCLUDED.{c}' for c in value_columns)}) "
+            f"WHERE ({', '.join(f't.{c}' for c in value_columns)}) IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in value_columns)})")
+
+    def update(self, groups=None):
+        """
+        Bring the index up to date after a load, in the transaction of the load. Not committed.
+        :param groups: (year, station_id) pairs of the weather rows inserted or changed, e.g. InsertData.touched_groups.
+            Each station is recomputed from January 1st of its first touched year, so appending days only rewrites
+            the current year. All the stations are rebuilt if not given, or if the index is still empty while
+            weather_data has rows, e.g. for weather data loaded before the index existed.
+        :return: number of rows written to weather_cumulative
+        """
+        if groups is not None:
+            self.db.cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM weather_cumulative) AND EXISTS (SELECT 1 FROM weather_data)")
+            if self.db.cursor.fetchone()[0]:
+                groups = None
+        if groups is None:
+            self.db.cursor.execute("TRUNCATE weather_cumulative")
+            self.db.cursor.execute("SELECT DISTINCT station_id FROM weather_data")
+            from_dates = {station_id: None for station_id, in self.db.cursor.fetchall()}
+        else:
+            from_dates = {}
+            for year, station_id in groups:
+                from_dates[station_id] = min(from_dates.get(station_id, int(year)), int(year))
+            from_dates = {station_id: datetime.date(year, 1, 1) for station_id, year in from_dates.items()}
+            # a station without any row in the index yet is built from its first date
+            self.db.cursor.execute("SELECT s.station_id FROM unnest(%s::varchar[]) AS s(station_id) "
+                                   "WHERE NOT EXISTS (SELECT 1 FROM weather_cumulative c WHERE c.station_id = s.station_id)",
+                                   (list(from_dates),))
+            for station_id, in self.db.cursor.fetchall():
+                from_dates[station_id] = None
+        if not from_dates:
+            return 0
+        # the very first date of a station, -infinity, when it is built from scratch
+        self.db.cursor.execute(self.update_query, (list(from_dates), [date or '-infinity' for date in from_dates.values()]))
+        return self.db.cursor.rowcount
+
+    def windowStats(self, grouping, station_id=None, start_date=None, end_date=None, season_start=None, season_end=None,
+                    page_size=20, page_number=1):
+        """
+        Statistics per station over date windows, each window computed from two rows of the index.
+        * month: one window per calendar month
+        * season: one window per year from season_start to season_end, e.g. a growing season 04-01 to 09-30
+        * window: a single window from start_date to end_date
+        Windows are clipped to start_date, end_date and the dates of the station. A window without any valid value
+        has null statistics.
+        :param grouping: month, season or window
+        :param station_id: station to compute, all stations if not given
+        :param start_date: first date 'YYYY-MM-DD', from the first date of each station if not given
+        :param end_date: last date 'YYYY-MM-DD', until the last date of each station if not given
+        :param season_start: first day of the season 'MM-DD', for the season grouping
+        :param season_end: last day of the season 'MM-DD', for the season grouping, before season_start if it ends the next year
+        :param page_size: number of windows to return
+        :param page_number: page of the windows, the first page is 1
+        :return: dataframe with the columns station_id, start_date, end_date, avg_max_temperature, avg_min_temperature,
+            total_precipitation_amount, preceded by year and month for the month grouping and by the year the season starts for
+            the season grouping
+        """
+        params = {'station_id': station_id, 'start_date': start_date, 'end_date': end_date,
+                  'limit': int(page_size), 'offset': (int(page_number) - 1) * int(page_size)}
+        if grouping == 'month':
+            windows = ("SELECT b.station_id, GREATEST(m::date, b.first_date) AS start_date, "
+                       "LEAST((m + interval '1 month - 1 day')::date, b.last_date) AS end_date "
+                       "FROM bounds b CROSS JOIN LATERAL generate_series(date_trunc('month', b.first_date), b.last_date, interval '1 month') m")
+            labels = "EXTRACT(YEAR FROM w.start_date)::integer AS year, EXTRACT(MONTH FROM w.start_date)::integer AS month, "
+        elif grouping == 'season':
+            try:
+                season = [datetime.datetime.strptime(f"2000-{day}", '%Y-%m-%d') for day in (season_start, season_end)]
+            except (TypeError, ValueError):
+                raise ValueError("season_start and season_end are required as MM-DD for the season grouping")
+            params.update({'start_month': season[0].month, 'start_day': season[0].day, 'end_month': season[1].month, 'end_day': season[1].day,
+                           'next_year': int(season[1] < season[0])})
+            # day - 1 added to the first of the month, so a 02-29 season start falls on March 1st in the other years
+            # and a 02-29 season end is clamped to the end of February
+            windows = ("SELECT * FROM (SELECT b.station_id, y AS year, "
+                       "GREATEST(make_date(y, %(start_month)s, 1) + (%(start_day)s - 1), b.first_date) AS start_date, "
+                       "LEAST(make_date(y + %(next_year)s, %(end_month)s, 1) + (%(end_day)s - 1), "
+                       "(make_date(y + %(next_year)s, %(end_month)s, 1) + interval '1 month - 1 day')::date, b.last_date) AS end_date "
+                       "FROM bounds b CROSS JOIN LATERAL generate_series(EXTRACT(YEAR FROM b.first_date)::integer - %(next_year)s, "
+                       "EXTRACT(YEAR FROM b.last_date)::integer) y) s WHERE start_date <= end_date")
+            # a season spanning two years is labelled with the year it starts
+            labels = "w.year, "
+        elif grouping == 'window':
+            windows = "SELECT b.station_id, b.first_date AS start_date, b.last_date AS end_date FROM bounds b WHERE b.first_date <= b.last_date"
+            labels = ""
+        else:
+            raise ValueError("grouping must be year, month, season or window")
+        if station_id is None:
+            # distinct stations read with one index lookup per station instead of a scan of the index
+            stations = ("WITH RECURSIVE stations AS (SELECT MIN(station_id) AS station_id FROM weather_cumulative "
+                        "UNION ALL SELECT (SELECT MIN(c.station_id) FROM weather_cumulative c WHERE c.station_id > s.station_id) "
+                        "FROM stations s WHERE s.station_id IS NOT NULL) ")
+        else:
+            stations = "WITH RECURSIVE stations AS (SELECT %(station_id)s::varchar AS station_id) "
+        stats = []
+        for column, prefix in cumulative_metrics:
+            count = f"NULLIF(e.{prefix}_count - COALESCE(p.{prefix}_count, 0), 0)"
+            delta = f"(e.{prefix}_sum - COALESCE(p.{prefix}_sum, 0))"
+            if prefix == 'precip':
+                # tenths of millimeters to centimeters, null without any valid value
+                stats.append(f"(CASE WHEN {count} IS NOT NULL THEN {delta} / 100.0 END)::float AS total_precipitation_amount")
+            else:
+                # tenths of degrees Celsius to degrees Celsius
+                stats.append(f"({delta}::float / {count} / 10) AS avg_{column}")
+        # only the windows of the requested page are looked up in the index
+        query = (f"{stations}, bounds AS (SELECT s.station_id, GREATEST(f.date, %(start_date)s::date) AS first_date, "
+                 f"LEAST(l.date, %(end_date)s::date) AS last_date FROM stations s "
+                 f"CROSS JOIN LATERAL (SELECT c.date FROM weather_cumulative c WHERE c.station_id = s.station_id ORDER BY c.date LIMIT 1) f "
+                 f"CROSS JOIN LATERAL (SELECT c.date FROM weather_cumulative c WHERE c.station_id = s.station_id ORDER BY c.date DESC LIMIT 1) l "
+                 f"WHERE s.station_id IS NOT NULL), "
+                 f"windows AS ({windows}), "
+                 f"page AS (SELECT * FROM windows ORDER BY start_date, station_id LIMIT %(limit)s OFFSET %(offset)s) "
+                 f"SELECT {labels}w.station_id, w.start_date, w.end_date, {', '.join(stats)} FROM page w "
+                 f"LEFT JOIN LATERAL (SELECT * FROM weather_cumulative c WHERE c.station_id = w.station_id AND c.date <= w.end_date "
+                 f"ORDER BY c.date DESC LIMIT 1) e ON true "
+                 f"LEFT JOIN LATERAL (SELECT * FROM weather_cumulative c WHERE c.station_id = w.station_id AND c.date < w.start_date "
+                 f"ORDER BY c.date DESC LIMIT 1) p ON true "
+                 f"ORDER BY w.start_date, w.station_id")
+        df = pd.read_sql(query, self.db.conn, params=params)
+        for column in ('start_date', 'end_date'):
+            df[column] = pd.to_datetime(df[column]).dt.strftime('%Y-%m-%d')
+        return df
@@ -1,4 +1,7 @@
+import base64
 import datetime
+import io
+import json
 import logging
 
 import psycopg2
@@ -6,69 +9,153 @@ import pandas as pd
 import numpy as np
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
+from src.cache import invalidateCache
+from src.catalog import StationCatalog, totalPages
+from src.columnar import ColumnarSnapshot, snapshot_serve_stats
+from src.cumulative import CumulativeIndex
 from src.db_conn import Database
+from src.manifest import IngestManifest
+from src.metrics import stageTimer
 
 logging.basicConfig(filename='../logs.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+# columnar snapshot used to answer the statistics requests when enabled with serve_stats in CONFIG.ini
+columnar_snapshot = ColumnarSnapshot()
+
+
+# Column names of the raw tab separated files and the compact dtypes used to parse them
+weather_file_columns = ["date_column", "max_temperature", "min_temperature", "precipitation_amount"]
+weather_file_dtypes = {"date_column": str, "max_temperature": np.int16, "min_temperature": np.int16, "precipitation_amount": np.int32}
+yield_file_columns = ['year', 'amount']
+yield_file_dtypes = {'year': np.int16, 'amount': np.int32}
+
+
+def openTail(file_path, offset):
+    """
+    Open a data file for parsing, skipping the first offset bytes that were already loaded.
+    :param file_path: path of the file
+    :param offset: byte offset where the unread part of the file starts, 0 for the whole file
+    :return: path or in memory buffer accepted by pd.read_csv
+    """
+    if not offset:
+        return file_path
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        return io.BytesIO(file.read())
+
+
+def readWeatherFile(file_path, offset=0):
+    """
+    Parse one station file of the weather data directory. Defined at module level so it can run in a worker process.
+    :param file_path: path of the station_id.txt file
+    :param offset: byte offset to start reading from, used to load only the rows appended since the last run
+    :return: dataframe with the columns station_id, date_column, max_temperature, min_temperature, precipitation_amount
+    """
+    # Read the file into a pandas data frame, using the column names and compact integer dtypes with tab delimiter
+    try:
+        df = pd.read_csv(openTail(file_path, offset), names=weather_file_columns, dtype=weather_file_dtypes, delimiter='\t')
+    except pd.errors.EmptyDataError:
+        # nothing was appended after the offset
+        df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in weather_file_dtypes.items()})
+    # Convert the date column to a pandas datetime object
+    df['date_column'] = pd.to_datetime(df['date_column'], format='%Y%m%d')
+    # extract the station_id from the filenames station_id.txt using split
+    df.insert(0, 'station_id', os.path.basename(file_path).split('.')[0])
+    return df
+
+
+def readYieldFile(file_path, offset=0):
+    """
+    Parse one file of the yield data directory. Defined at module level so it can run in a worker process.
+    :param file_path: path of the yield .txt file
+    :param offset: byte offset to start reading from, used to load only the rows appended since the last run
+    :return: dataframe with the columns year, amount
+    """
+    try:
+        return pd.read_csv(openTail(file_path, offset), names=yield_file_columns, dtype=yield_file_dtypes, delimiter='\t')
+    except pd.errors.EmptyDataError:
+        # nothing was appended after the offset
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in yield_file_dtypes.items()})
+
 
 class DataOperations:
-    def __init__(self):
+    def __init__(self, workers=None, weather_data_path="../wx_data/", yield_data_path='../yld_data/'):
+        """
+        :param workers: number of processes used to parse the data files, defaults to the number of cpu cores
+        :param weather_data_path: directory of the weather station files
+        :param yield_data_path: directory of the yield files
+        """
         # Initialize instance variables with the paths to the weather and yield data directories
-        self.weather_data_path = "../wx_data/"
-        self.yield_data_path = '../yld_data/'
-
-    def createYieldData(self):
-        # Get a list of all the text files in the yield data directory
-        all_files = os.listdir(self.yield_data_path)
-        # Extract only the files that end with .txt
-        txt_files = [f for f in all_files if f.endswith('.txt')]
-        # Define the column names for the yield dataframe
-        cols = ['year', 'amount']
-        # Create an empty data frame with the above column names
-        df = pd.DataFrame(columns=cols)
-        # Loop through each text file in the directory
-        for file in txt_files:
-            # Read the file into a pandas data frame, using the above column names and tab delimiter
-            temp = pd.read_csv(self.yield_data_path + file, names=cols, delimiter='\t')
-            # Concatenate the data frame for this file with the previous data frames
-            df = pd.concat([df, temp], ignore_index=True)
-        # Return the final data frame containing all the yield data
-        return df
+        self.weather_data_path = weather_data_path
+        self.yield_data_path = yield_data_path
+        self.workers = workers or os.cpu_count() or 1
 
-    def createWeatherData(self):
-        # Get a list of all the text files in the weather data directory
-        all_files = os.listdir(self.weather_data_path)
-        # extracting only the text files in the folder
-        txt_files = [f for f in all_files if f.endswith('.txt')]
-        # Define the column names for the weather dataframe
-        cols = ['station_id', "date_column", "max_temperature", "min_temperature", "precipitation_amount"]
-        df = pd.DataFrame(columns=cols)
-        # Loop through each text file in the directory
-        for file in txt_files:
-            # Read the file into a pandas data frame, using the above column names and tab delimiter
-            temp = pd.read_csv(self.weather_data_path + file, names=["date_column", "max_temperature", "min_temperature", "precipitation_amount"], delimiter='\t')
-            # extract the station_id from the filenames station_id.txt using split
-            temp['station_id'] = file.split('.')[0]
-            df = pd.concat([df, temp], ignore_index=True)
-        # Convert the date column to a pandas datetime object
-        df['date_column'] = pd.to_datetime(df['date_column'], format='%Y%m%d')
-        return df
+    def listFiles(self, directory):
+        # Get a list of all the text files in the directory, sorted so the load order is stable
+        return sorted(f for f in os.listdir(directory) if f.endswith('.txt'))
+
+    def parseFiles(self, reader, directory, files, columns, offsets=None):
+        """
+        Parse the given files across a process pool and combine the results once at the end.
+        :param reader: module level function parsing a single file into a dataframe
+        :param directory: directory containing the files
+        :param files: file names to parse
+        :param columns: columns of the resulting dataframe, used when there is no file to parse
+        :param offsets: byte offset to start reading each file from, defaults to reading the whole files
+        :return: dataframe with the rows of all the files
+        """
+        paths = [os.path.join(directory, f) for f in files]
+        offsets = offsets or [0] * len(paths)
+        if self.workers > 1 and len(paths) > 1:
+            workers = min(self.workers, len(paths))
+            # hand the files to the workers in chunks to keep the inter process overhead low
+            chunksize = max(1, len(paths) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                frames = list(executor.map(reader, paths, offsets, chunksize=chunksize))
+        else:
+            frames = [reader(path, offset) for path, offset in zip(paths, offsets)]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        # a single concat at the end instead of growing the dataframe file by file
+        return pd.concat(frames, ignore_index=True)
+
+    def createYieldData(self, files=None, offsets=None):
+        # Parse the given text files of the yield data directory into one data frame, all of them by default
+        files = self.listFiles(self.yield_data_path) if files is None else files
+        return self.parseFiles(readYieldFile, self.yield_data_path, files, yield_file_columns, offsets)
+
+    def createWeatherData(self, files=None, offsets=None):
+        # Parse the given text files of the weather data directory into one data frame, all of them by default
+        files = self.listFiles(self.weather_data_path) if files is None else files
+        cols = ['station_id'] + weather_file_columns
+        return self.parseFiles(readWeatherFile, self.weather_data_path, files, cols, offsets)
 
 
 class InsertData:
-    def __init__(self):
+    def __init__(self, workers=None):
+        """
+        :param workers: number of processes used to parse the data files, defaults to the number of cpu cores
+        """
         self.yield_table_name = 'yield_data'
         self.weather_table_name = 'weather_data'
-        self.insert_queries = {
-            self.weather_table_name: f"INSERT INTO {self.weather_table_name} (station_id, date, max_temperature, min_temperature, precipitation_amount) VALUES (%s, %s, %s, %s, %s)",
-            self.yield_table_name: f""" INSERT INTO {self.yield_table_name} (year, value) VALUES (%s, %s)"""
+        # target columns of each table, in the same order as the dataframes built by DataOperations
+        self.table_columns = {
+            self.weather_table_name: ['station_id', 'date', 'max_temperature', 'min_temperature', 'precipitation_amount'],
+            self.yield_table_name: ['year', 'value']
         }
-        self.duplicate_check = {
-            self.weather_table_name: f"SELECT EXISTS(SELECT 1 FROM {self.weather_table_name} WHERE station_id=%s AND date=%s AND max_temperature=%s AND min_temperature=%s AND precipitation_amount=%s )",
-            self.yield_table_name: f"SELECT EXISTS(SELECT 1 FROM {self.yield_table_name} WHERE year=%s AND value=%s)"
+        # unique key of each table, a row is a duplicate if a row with the same key is already stored
+        self.key_columns = {
+            self.weather_table_name: ['station_id', 'date'],
+            self.yield_table_name: ['year']
         }
-        self.dataop = DataOperations()
+        self.dataop = DataOperations(workers)
+        # (year, station_id) pairs of the weather rows inserted or changed by the last insertData call
+        self.touched_groups = []
         self.db = Database()
+        self.manifest = IngestManifest(self.db)
+        self.cumulative = CumulativeIndex(self.db)
+        self.catalog = StationCatalog(self.db)
         # get the table names that has been created in the database
         self.db.cursor.execute("SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname='public';")
         self.tables = [each[0] for each in self.db.cursor.fetchall()]
@@ -76,41 +163,133 @@ class InsertData:
         if self.yield_table_name or self.weather_table_name not in self.tables:
             self.db.createTable()
 
-    def insertData(self, table_name):
+    def insertData(self, table_name, full_reload=False):
         """
         Method to insert data into the specified table.
         :param table_name: parameter table name where the data need to be stored
+        :param full_reload: load every file of the directory even if the manifest says it is unchanged
         :return: None
-        Insert data from directory to database tables based on table name input
+        Insert data from directory to database tables based on table name input. Files recorded in the ingest manifest
+        as unchanged are skipped and files that only grew are loaded from where the previous run stopped.
         """
         assert table_name == self.weather_table_name or table_name == self.yield_table_name, "Please enter a valid table name"
         start_time = time.time()
         try:
+            directory = self.dataop.weather_data_path if table_name == self.weather_table_name else self.dataop.yield_data_path
+            # compare the files on disk with the manifest to find what changed since the last run
+            with stageTimer('list_files', table_name):
+                all_files = self.dataop.listFiles(directory)
+            with stageTimer('plan', table_name):
+                to_load, to_touch = self.manifest.plan(table_name, directory, all_files, full_reload)
+            files = [entry['file_name'] for entry in to_load]
+            offsets = [entry['offset'] for entry in to_load]
             if table_name == self.weather_table_name:
-                data = self.dataop.createWeatherData()
+                with stageTimer('parse', table_name):
+                    data = self.dataop.createWeatherData(files, offsets)
+                # for the files read from an offset drop any row at or before the last date already loaded
+                cutoffs = {entry['file_name'].split('.')[0]: entry['last_date'] for entry in to_load if entry['offset']}
+                if cutoffs:
+                    cutoff = pd.to_datetime(data['station_id'].map(cutoffs))
+                    data = data[~(data['date_column'] <= cutoff)]
+                # remember the last date loaded per station
+                last_dates = data.groupby('station_id')['date_column'].max()
+                for entry in to_load:
+                    station_last_date = last_dates.get(entry['file_name'].split('.')[0])
+                    if station_last_date is not None and (entry['last_date'] is None or station_last_date.date() > entry['last_date']):
+                        entry['last_date'] = station_last_date.date()
             if table_name == self.yield_table_name:
-                data = self.dataop.createYieldData()
-            insert_query = self.insert_queries[table_name]
-            logging.info(f"Data ingestion process started at {start_time}")
-            res = []
-            for idx, row in data.iterrows():
-                self.db.cursor.execute(self.duplicate_check[table_name], tuple(row))
-                if not self.db.cursor.fetchone()[0]:
-                    res.append(tuple(row))
-            records = len(res)
-            if len(res) > 0:
-                self.db.cursor.executemany(insert_query, res)
+                with stageTimer('parse', table_name):
+                    data = self.dataop.createYieldData(files, offsets)
+            logging.info(f"Data ingestion process started at {start_time}. Files to load: {len(to_load)}, unchanged files skipped: {len(all_files) - len(to_load)}")
+            if table_name == self.weather_table_name and len(data):
+                # a partitioned weather_data needs a partition for every year loaded, creating one locks the table
+                # so it is committed right away instead of being held for the whole load
+                years = data['date_column'].dt.year
+                if self.db.ensurePartitions(table_name, years.min(), years.max()):
+                    self.db.conn.commit()
+            # bulk load the rows through a staging table, duplicates are skipped by the database on the unique key
+            if table_name == self.weather_table_name:
+                # corrected values replace the stored ones, and the (year, station_id) groups that changed are kept
+                # so the statistics can be refreshed for those groups only
+                records, groups = self.db.bulkMerge(table_name, self.table_columns[table_name], data, self.key_columns[table_name],
+                                                    update_changed=True, group_by="EXTRACT(YEAR FROM date)::integer, station_id")
+                self.touched_groups = [(year, station_id) for year, station_id, count in groups]
+                # running sums of the touched stations, in the same transaction as the rows they are computed from
+                with stageTimer('cumulative', table_name):
+                    self.cumulative.update(self.touched_groups)
+                # coverage of the touched stations, built in full the first time
+                with stageTimer('catalog', table_name):
+                    self.catalog.update(self.touched_groups)
             else:
-                records = 0
-            self.db.conn.commit()
+                records = self.db.bulkMerge(table_name, self.table_columns[table_name], data, self.key_columns[table_name])
+            # the manifest is updated in the same transaction as the data it describes
+            self.manifest.record(table_name, to_load + to_touch)
+            with stageTimer('commit', table_name):
+                self.db.conn.commit()
+            if records:
+                # cached API responses may contain the old data
+                invalidateCache()
             end_time = time.time()
             logging.info(f"Data ingestion process ended at {end_time}. Number of non duplicate records ingested into the table [{table_name}] : {records}")
         except Exception as e:
+            self.touched_groups = []
+            self.db.conn.rollback()
             logging.info(f"Error {e} occurred at {start_time} while inserting data into {table_name}")
 
 
+def encodeCursor(station_id, date):
+    """
+    Build the opaque pagination cursor pointing after the given row.
+    :param station_id: station_id of the last row of the page
+    :param date: date of the last row of the page
+    :return: url safe cursor token
+    """
+    key = json.dumps([station_id, pd.Timestamp(date).strftime('%Y-%m-%d')])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decodeCursor(cursor):
+    """
+    Read back the (station_id, date) key stored in a pagination cursor.
+    :param cursor: cursor token returned by encodeCursor
+    :return: tuple (station_id, date as 'YYYY-MM-DD')
+    """
+    try:
+        station_id, date = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return str(station_id), datetime.datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor {cursor}")
+
+
+def fetchYieldWeather(db, start_year=None, end_year=None):
+    """
+    Read the yearly crop yield with the weather of the year, and the correlations of the yield with the weather,
+    from the materialized views refreshed by insert_data.py.
+    :param db: Database connection
+    :param start_year: first year to return, from the first year if not given
+    :param end_year: last year to return, until the last year if not given
+    :return: tuple (dataframe of the years, dataframe of the correlations), both empty if the views do not exist yet
+    """
+    db.cursor.execute("SELECT to_regclass('yield_weather_yearly') IS NOT NULL AND to_regclass('yield_weather_correlation') IS NOT NULL")
+    if not db.cursor.fetchone()[0]:
+        return pd.DataFrame(), pd.DataFrame()
+    query = ("SELECT year, yield_value, avg_max_temperature, avg_min_temperature, avg_total_precipitation_amount, station_count "
+             "FROM yield_weather_yearly WHERE 1=1")
+    params = []
+    if start_year is not None:
+        query += " AND year >= %s"
+        params.append(int(start_year))
+    if end_year is not None:
+        query += " AND year <= %s"
+        params.append(int(end_year))
+    years = pd.read_sql(query + " ORDER BY year", db.conn, params=params)
+    # correlations are computed over all the years
+    correlations = pd.read_sql("SELECT metric, correlation, slope, years FROM yield_weather_correlation ORDER BY metric", db.conn)
+    return years, correlations
+
+
 class FetchData:
-    def __init__(self, start_date, end_date, station_id, page_size=20, page_number=1):
+    def __init__(self, start_date, end_date, station_id, page_size=20, page_number=1, cursor=None, db=None, with_total=False):
         """
         Initialize the FetchData class with the given parameters.
         :param start_date: The start date of the weather data to fetch in the format 'YYYY-MM-DD'.
@@ -118,47 +297,238 @@ class FetchData:
         :param station_id: The ID of the weather station to fetch data for.
         :param page_size: The number of rows to return per page for pagination. Defaults to 20.
         :param page_number: The current page number for pagination. The first page has a default page_number of 1.
+        :param cursor: The next_cursor token of the previous page for cursor pagination, '' for the first page.
+            When it is given page_number is ignored.
+        :param db: Database connection checked out by the caller, a new one is checked out from the pool if not given.
+        :param with_total: count the matching rows on every page, by default they are only counted on the first page
         """
-        self.db = Database()
+        self.db = db or Database()
         self.weather_table_name = 'weather_data'
         self.page_size = int(page_size)
         self.page_num = int(page_number)
+        self.cursor = cursor
+        self.next_cursor = None
+        self.with_total = with_total
+        # number of rows and pages of the query, from the station catalog, None if not counted or until the catalog is built
+        self.total_count = None
+        self.total_pages = None
+        self.start_date = start_date if start_date and start_date != 'None' else None
+        self.end_date = end_date if end_date and end_date != 'None' else None
+        self.station_id = station_id if station_id and station_id != 'None' else None
+        # filter conditions on weather_data, their values are passed to the database as query parameters
+        self.filters = ""
+        self.params = []
+        if self.start_date:
+            self.filters += " AND date >= %s"
+            self.params.append(self.start_date)
+        if self.end_date:
+            self.filters += " AND date <= %s"
+            self.params.append(self.end_date)
+        if self.station_id:
+            self.filters += " AND station_id = %s"
+            self.params.append(self.station_id)
         self.fetch_queries = {
-            self.weather_table_name: f"SELECT * FROM {self.weather_table_name} WHERE 1=1",
+            self.weather_table_name: f"SELECT * FROM {self.weather_table_name} WHERE 1=1{self.filters}",
         }
-        if start_date and start_date != 'None' or None:
-            self.fetch_queries[self.weather_table_name] += f" AND date >= '{start_date}'"
-        if end_date and end_date != 'None' or None:
-            self.fetch_queries[self.weather_table_name] += f" AND date <= '{end_date}'"
-        if station_id and station_id != 'None' or None:
-            self.fetch_queries[self.weather_table_name] += f" AND station_id = '{station_id}'"
 
     def fetchData(self):
         """
         Fetch weather data from the database based on the user input and return it as a Pandas dataframe.
         :return: return dataframe of records based on the user input
         """
-        # page_size is the number of rows to return per page, and page_number is the current page number.
-        # The first page has a page_number of 1, and the OFFSET is calculated as (page_number - 1) * page_size.
-        self.fetch_queries[self.weather_table_name] += f" LIMIT {self.page_size} OFFSET {(self.page_num-1) * self.page_size}"
-        df = pd.read_sql(self.fetch_queries[self.weather_table_name], self.db.conn)
+        # the count scans the partial years at the ends of the date range, so it is done once on the first page
+        # and the next pages of a crawl only cost their own index range scan
+        first_page = self.cursor == '' or (self.cursor is None and self.page_num == 1)
+        if first_page or self.with_total:
+            self.total_count = StationCatalog(self.db).countRows(self.station_id, self.start_date, self.end_date)
+        if self.total_count is not None:
+            self.total_pages = totalPages(self.total_count, self.page_size)
+            if self.total_count == 0:
+                # unknown station or dates outside its coverage, answered without reading weather_data
+                return pd.DataFrame(columns=['station_id', 'date', 'max_temperature', 'min_temperature', 'precipitation_amount'])
+        params = list(self.params)
+        if self.cursor is not None:
+            # keyset pagination: continue right after the (station_id, date) of the last row of the previous page,
+            # served by the unique index on (station_id, date) so every page costs the same
+            if self.cursor:
+                self.fetch_queries[self.weather_table_name] += " AND (station_id, date) > (%s, %s)"
+                params.extend(decodeCursor(self.cursor))
+            self.fetch_queries[self.weather_table_name] += " ORDER BY station_id, date LIMIT %s"
+            params.append(self.page_size)
+        else:
+            # page_size is the number of rows to return per page, and page_number is the current page number.
+            # The first page has a page_number of 1, and the OFFSET is calculated as (page_number - 1) * page_size.
+            self.fetch_queries[self.weather_table_name] += " ORDER BY station_id, date LIMIT %s OFFSET %s"
+            params.extend([self.page_size, (self.page_num - 1) * self.page_size])
+        df = pd.read_sql(self.fetch_queries[self.weather_table_name], self.db.conn, params=params)
+        # a full page means there may be more rows after it
+        if len(df) == self.page_size and self.page_size > 0:
+            self.next_cursor = encodeCursor(df['station_id'].iloc[-1], df['date'].iloc[-1])
         return df
 
-    def fetchDataStats(self):
+    def streamData(self, batch_size=5000):
+        """
+        Read all the weather data matching the user input through a server side cursor, ordered on (station_id, date),
+        so only one batch of rows is held in memory at a time.
+        :param batch_size: number of rows fetched from the database per round trip
+        :return: generator of lists of (station_id, date, max_temperature, min_temperature, precipitation_amount) tuples
         """
-        Fetch weather data from the database based on the user input, remove records with missing values which is -9999,
-        and return the result as a Pandas dataframe.
-        :return: return dataframe of records without missing values based on the user input
+        query = (f"SELECT station_id, date, max_temperature, min_temperature, precipitation_amount "
+                 f"FROM {self.weather_table_name} WHERE 1=1{self.filters} ORDER BY station_id, date")
+        # a named cursor keeps the result set on the server, rows are transferred batch_size at a time
+        with self.db.conn.cursor(name='weather_export') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, self.params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        # close the transaction holding the server side cursor
+        self.db.conn.rollback()
+
+    def coversWholeYears(self):
         """
-        self.fetch_queries[self.weather_table_name] += f" AND max_temperature <> -9999 "
-        self.fetch_queries[self.weather_table_name] += f" AND min_temperature <> -9999 "
-        self.fetch_queries[self.weather_table_name] += f" AND precipitation_amount <> -9999 "
+        Check if the date filter selects whole calendar years, from January 1st to December 31st.
+        :return: True if the yearly statistics in weather_data_stats answer the request exactly
+        """
+        try:
+            start = datetime.datetime.strptime(self.start_date, '%Y-%m-%d') if self.start_date else None
+            end = datetime.datetime.strptime(self.end_date, '%Y-%m-%d') if self.end_date else None
+        except ValueError:
+            return False
+        return (start is None or (start.month, start.day) == (1, 1)) and (end is None or (end.month, end.day) == (12, 31))
+
+    def fetchDataStats(self, grouping='year', season_start=None, season_end=None):
+        """
+        Fetch the statistics per year and station for the user input and return them as a Pandas dataframe:
+        average maximum and minimum temperature in degrees Celsius and total precipitation in centimeters,
+        each measurement ignoring its own missing values which is -9999.
+        When the date filter covers whole years the precomputed weather_data_stats table is read, otherwise the
+        aggregation runs in the database on weather_data. Only one page of the aggregated result is returned.
+        The month, season and window groupings are computed from the weather_cumulative prefix sums, see CumulativeIndex.windowStats.
+        :param grouping: year (default), month, season or window
+        :param season_start: first day of the season 'MM-DD' for the season grouping
+        :param season_end: last day of the season 'MM-DD' for the season grouping
+        :return: return dataframe with the columns year, station_id, avg_max_temperature, avg_min_temperature,
+            total_precipitation_amount
+        """
+        if grouping and grouping != 'year':
+            return CumulativeIndex(self.db).windowStats(grouping, self.station_id, self.start_date, self.end_date,
+                                                        season_start, season_end, self.page_size, self.page_num)
+        # computed from the memory mapped columnar snapshot, without querying the database, if there is one
+        analysis = columnar_snapshot.yearlyStats(self.station_id, self.start_date, self.end_date) if snapshot_serve_stats else None
+        if analysis is not None:
+            analysis = analysis.rename(columns={'max_temperature': 'avg_max_temperature', 'min_temperature': 'avg_min_temperature', 'precipitation_amount': 'total_precipitation_amount'})
+            offset = (self.page_num - 1) * self.page_size
+            return analysis.iloc[offset:offset + self.page_size].reset_index(drop=True)
+        self.db.cursor.execute("SELECT to_regclass('weather_data_stats') IS NOT NULL")
+        if self.coversWholeYears() and self.db.cursor.fetchone()[0]:
+            query = "SELECT year, station_id, avg_max_temperature, avg_min_temperature, total_precipitation_amount FROM weather_data_stats WHERE 1=1"
+            params = []
+            if self.start_date:
+                query += " AND year >= %s"
+                params.append(int(self.start_date[:4]))
+            if self.end_date:
+                query += " AND year <= %s"
+                params.append(int(self.end_date[:4]))
+            if self.station_id:
+                query += " AND station_id = %s"
+                params.append(self.station_id)
+        else:
+            # max temperature and min temperature are in tenths of degrees Celsius, precipitation in tenths of millimeters
+            # NULLIF turns a missing value into NULL, which AVG, SUM and COUNT skip, the same rules as stats_kernel
+            query = (f"SELECT EXTRACT(YEAR FROM date)::integer AS year, station_id, "
+                     f"(AVG(NULLIF(max_temperature, -9999)) / 10)::float AS avg_max_temperature, "
+                     f"(AVG(NULLIF(min_temperature, -9999)) / 10)::float AS avg_min_temperature, "
+                     f"(SUM(NULLIF(precipitation_amount, -9999)) / 100.0)::float AS total_precipitation_amount "
+                     f"FROM {self.weather_table_name} WHERE 1=1{self.filters} "
+                     f"GROUP BY 1, 2 HAVING COUNT(NULLIF(max_temperature, -9999)) + COUNT(NULLIF(min_temperature, -9999)) "
+                     f"+ COUNT(NULLIF(precipitation_amount, -9999)) > 0")
+            params = list(self.params)
         # page_size is the number of rows to return per page, and page_number is the current page number.
         # The first page has a page_number of 1, and the OFFSET is calculated as (page_number - 1) * page_size
-        # self.fetch_queries[self.weather_table_name] += f" LIMIT {self.page_size} OFFSET {((self.page_num - 1) * self.page_size)}"
-        df = pd.read_sql(self.fetch_queries[self.weather_table_name], self.db.conn)
+        query += " ORDER BY year, station_id LIMIT %s OFFSET %s"
+        params.extend([self.page_size, (self.page_num - 1) * self.page_size])
+        df = pd.read_sql(query, self.db.conn, params=params)
         return df
 
 
+class BatchFetchData:
+    def __init__(self, specs, mode='stats', page_size=20, page_number=1, db=None):
+        """
+        Answer many station and date range lookups with a single query.
+        :param specs: list of dicts with a station_id and an optional start_date and end_date 'YYYY-MM-DD'
+        :param mode: 'stats' for the statistics per year of every spec, 'raw' for a page of its weather records
+        :param page_size: number of rows returned per spec
+        :param page_number: page of the rows of every spec, the first page is 1
+        :param db: Database connection checked out by the caller, a new one is checked out from the pool by fetchBatch
+            if not given, so invalid specs are rejected without taking a connection
+        """
+        if mode not in ('stats', 'raw'):
+            raise ValueError("mode must be stats or raw")
+        if not isinstance(specs, list) or not specs:
+            raise ValueError("specs must be a non empty list of {station_id, start_date, end_date}")
+        self.specs = []
+        for spec in specs:
+            if not isinstance(spec, dict) or not spec.get('station_id'):
+                raise ValueError(f"Invalid spec {spec}, station_id is required")
+            dates = []
+            for name in ('start_date', 'end_date'):
+                value = spec.get(name)
+                try:
+                    dates.append(datetime.datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else None)
+                except (TypeError, ValueError):
+                    raise ValueError(f"Invalid {name} {value}, expected YYYY-MM-DD")
+            self.specs.append((str(spec['station_id']), dates[0], dates[1]))
+        self.mode = mode
+        try:
+            self.page_size = int(page_size)
+            self.page_num = int(page_number)
+        except (TypeError, ValueError):
+            raise ValueError("page_size and page_number must be integers")
+        if self.page_size < 0 or self.page_num < 1:
+            raise ValueError("page_size must be at least 0 and page_number at least 1")
+        self.db = db
+        self.weather_table_name = 'weather_data'
 
-
+    def fetchBatch(self):
+        """
+        Run every spec in one round trip: the specs are sent as arrays, unnested into rows and joined laterally with
+        weather_data, so each spec is a range scan of the unique index on (station_id, date) with its own pagination.
+        :return: list with one dict per spec, in the order of the specs, with the spec and its data as records
+        """
+        if self.db is None:
+            self.db = Database()
+        if self.mode == 'raw':
+            rows = (f"SELECT w.station_id, w.date, w.max_temperature, w.min_temperature, w.precipitation_amount "
+                    f"FROM {self.weather_table_name} w "
+                    f"WHERE w.station_id = s.station_id AND w.date >= s.start_date AND w.date <= s.end_date "
+                    f"ORDER BY w.date LIMIT %s OFFSET %s")
+            order = "r.date"
+        else:
+            # same rules as FetchData.fetchDataStats, each measurement ignores its own missing values
+            rows = (f"SELECT EXTRACT(YEAR FROM w.date)::integer AS year, w.station_id, "
+                    f"(AVG(NULLIF(w.max_temperature, -9999)) / 10)::float AS avg_max_temperature, "
+                    f"(AVG(NULLIF(w.min_temperature, -9999)) / 10)::float AS avg_min_temperature, "
+                    f"(SUM(NULLIF(w.precipitation_amount, -9999)) / 100.0)::float AS total_precipitation_amount "
+                    f"FROM {self.weather_table_name} w "
+                    f"WHERE w.station_id = s.station_id AND w.date >= s.start_date AND w.date <= s.end_date "
+                    f"GROUP BY 1, 2 HAVING COUNT(NULLIF(w.max_temperature, -9999)) + COUNT(NULLIF(w.min_temperature, -9999)) "
+                    f"+ COUNT(NULLIF(w.precipitation_amount, -9999)) > 0 "
+                    f"ORDER BY 1 LIMIT %s OFFSET %s")
+            order = "r.year"
+        # a missing date is an open bound, kept sargable on the index with infinite dates instead of OR conditions
+        query = (f"SELECT s.spec, r.* FROM (SELECT spec, station_id, COALESCE(start_date, '-infinity') AS start_date, "
+                 f"COALESCE(end_date, 'infinity') AS end_date "
+                 f"FROM unnest(%s::integer[], %s::varchar[], %s::date[], %s::date[]) AS u(spec, station_id, start_date, end_date)) s "
+                 f"JOIN LATERAL ({rows}) r ON true ORDER BY s.spec, {order}")
+        params = [list(range(len(self.specs))), [station_id for station_id, start, end in self.specs],
+                  [start for station_id, start, end in self.specs], [end for station_id, start, end in self.specs],
+                  self.page_size, (self.page_num - 1) * self.page_size]
+        df = pd.read_sql(query, self.db.conn, params=params)
+        if self.mode == 'raw':
+            df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
+        records = {spec: json.loads(group.drop(columns='spec').to_json(orient='records')) for spec, group in df.groupby('spec')}
+        return [{'station_id': station_id, 'start_date': start, 'end_date': end, 'data': records.get(spec, [])}
+                for spec, (station_id, start, end) in enumerate(self.specs)]
@@ -1,10 +1,16 @@
+import io
+import os
+import threading
 import psycopg2
+from psycopg2 import pool
 import pandas as pd
 import numpy as np
 import configparser
+from src.metrics import TimedCursor, stageTimer
 
 config = configparser.ConfigParser()
-config.read('src/CONFIG.ini')
+# CROP_WEATHER_CONFIG points to another configuration file, e.g. a throwaway database for the benchmarks
+config.read(os.environ.get('CROP_WEATHER_CONFIG', 'src/CONFIG.ini'))
 
 db_host = config['database']['host']
 db_port = config['database']['port']
@@ -12,30 +18,202 @@ db_name = config['database']['database']
 db_user = config['database']['user']
 db_password = config['database']['password']
 
+# connection pool size and how long to wait for a free connection, in seconds
+pool_min_size = config.getint('pool', 'min_size', fallback=1)
+pool_max_size = config.getint('pool', 'max_size', fallback=10)
+pool_timeout = config.getfloat('pool', 'timeout', fallback=30)
+
+# create weather_data partitioned by year instead of as a single table
+partitioned_weather_data = config.getboolean('schema', 'partitioned_weather_data', fallback=False)
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Thread safe connection pool that waits for a connection to be returned when all max_size connections are in use,
+    instead of raising PoolError straight away like ThreadedConnectionPool. min_size connections are opened up front.
+    """
+    def __init__(self, min_size, max_size, timeout, **kwargs):
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.timeout = timeout
+        super().__init__(min_size, max_size, **kwargs)
+
+    def getconn(self, key=None):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"No database connection available after {self.timeout} seconds")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self.slots.release()
+
+    def _putconn(self, conn, key=None, close=False):
+        # keep returned connections open for reuse up to max_size, the base class closes anything above min_size
+        min_size = self.minconn
+        self.minconn = self.maxconn
+        try:
+            super()._putconn(conn, key, close)
+        finally:
+            self.minconn = min_size
+
+
+connection_pool = None
+connection_pool_lock = threading.Lock()
+
+
+def getPool():
+    # Creates the connection pool of the process on first use
+    global connection_pool
+    with connection_pool_lock:
+        if connection_pool is None:
+            connection_pool = BlockingConnectionPool(
+                pool_min_size,
+                pool_max_size,
+                pool_timeout,
+                host=db_host,  # hostname where the database server is running
+                port=db_port,  # port number on which the database server is listening
+                dbname=db_name,  # name of the database to which the connection is made
+                user=db_user,  # username used to authenticate
+                password=db_password,  # password used to authenticate
+                cursor_factory=TimedCursor  # records the duration and row count of every statement
+            )
+        return connection_pool
+
+
+def checkoutConnection():
+    """
+    Take a healthy connection out of the pool. Connections that were closed by the server or fail a ping
+    are discarded and replaced with a new one.
+    :return: psycopg2 connection
+    """
+    connections = getPool()
+    for attempt in range(pool_max_size + 1):
+        conn = connections.getconn()
+        try:
+            if not conn.closed:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+                return conn
+        except psycopg2.Error:
+            pass
+        # broken connection, close it and try the next one
+        connections.putconn(conn, close=True)
+    raise pool.PoolError("Could not get a working database connection")
+
 
 class Database:
     def __init__(self):
-        # Initializes a connection to the PostgreSQL database server.
-        self.conn = psycopg2.connect(
-            host=db_host,  # hostname where the database server is running
-            port=db_port,  # port number on which the database server is listening
-            dbname=db_name,  # name of the database to which the connection is made
-            user=db_user,  # username used to authenticate
-            password=db_password  # password used to authenticate
-        )
+        # Checks out a connection to the PostgreSQL database server from the connection pool.
+        self.conn = checkoutConnection()
         # Initializes a cursor object to execute database queries.
         self.cursor = self.conn.cursor()
 
+    def close(self):
+        # Returns the connection to the pool, discarding any transaction left open.
+        if self.conn is None:
+            return
+        broken = True
+        try:
+            self.cursor.close()
+            if not self.conn.closed:
+                self.conn.rollback()
+                broken = False
+        except psycopg2.Error:
+            pass
+        getPool().putconn(self.conn, close=broken)
+        self.conn = None
+        self.cursor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def createTable(self):
         # Reads SQL queries from a file and executes them to create a new table in the database.
+        if partitioned_weather_data:
+            # creates weather_data partitioned by year first, the plain weather_data of create table.sql is then skipped
+            self.alterTable("weather_data_partitioned.sql")
         with open("create table.sql", 'r') as file:
             for line in file.readlines():
                 query = line.strip()
                 self.cursor.execute(query)
                 self.conn.commit()
 
-    def alterTable(self):
-        with open("alter_query.sql", 'r') as file:
+    def ensurePartitions(self, table_name, first_year, last_year):
+        """
+        Create the missing yearly partitions of a table partitioned by date, does nothing for a plain table.
+        :param table_name: partitioned table, e.g. weather_data
+        :param first_year: first year of the rows about to be loaded
+        :param last_year: last year of the rows about to be loaded
+        :return: True if the table is partitioned
+        """
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", (table_name,))
+        if not self.cursor.fetchone()[0]:
+            return False
+        self.cursor.execute("SELECT ensure_yearly_partitions(%s, %s, %s)", (table_name, int(first_year), int(last_year)))
+        return True
+
+    def bulkMerge(self, table_name, columns, data, key_columns, update_changed=False, group_by=None):
+        """
+        Stream a dataframe into the database with COPY and merge it into the target table in one statement.
+        Rows whose key already exists in the target table are skipped by the database (ON CONFLICT DO NOTHING),
+        or updated when their values changed if update_changed is set, so duplicate handling does not need a
+        round trip per row.
+        :param table_name: target table, it must have a unique index on key_columns
+        :param columns: target column names, in the same order as the dataframe columns
+        :param data: pandas dataframe with the rows to load
+        :param key_columns: columns of the unique key used to detect duplicates
+        :param update_changed: overwrite stored rows whose non key columns differ from the loaded ones
+        :param group_by: optional SQL expressions on the target columns, e.g. "station_id", to summarize which groups
+            of rows were inserted or updated
+        :return: number of rows inserted or updated in the target table, and when group_by is given also the list of
+            (group_by values..., number of rows) of the inserted or updated rows
+        """
+        staging_table = f"{table_name}_staging"
+        column_list = ", ".join(columns)
+        key_list = ", ".join(key_columns)
+        # session scoped staging table with the same layout as the target table, emptied after every commit
+        self.cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging_table} (LIKE {table_name}) ON COMMIT DELETE ROWS")
+        self.cursor.execute(f"TRUNCATE {staging_table}")
+        with stageTimer('copy', table_name):
+            # write the dataframe as csv into memory and stream it to the staging table
+            buffer = io.StringIO()
+            data.to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            self.cursor.copy_expert(f"COPY {staging_table} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+        # DISTINCT ON removes duplicates inside the batch itself, ON CONFLICT the ones already stored in the table
+        merge = (f"INSERT INTO {table_name} AS t ({column_list}) "
+                 f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging_table} ")
+        value_columns = [c for c in columns if c not in key_columns]
+        if update_changed and value_columns:
+            value_list = ", ".join(value_columns)
+            excluded_list = ", ".join(f"EXCLUDED.{c}" for c in value_columns)
+            merge += (f"ON CONFLICT ({key_list}) DO UPDATE SET ({value_list}) = ROW({excluded_list}) "
+                      f"WHERE (t.{', t.'.join(value_columns)}) IS DISTINCT FROM ({excluded_list})")
+        else:
+            merge += f"ON CONFLICT ({key_list}) DO NOTHING"
+        # deduplication and insert of the new rows happen in the merge statement
+        with stageTimer('merge', table_name):
+            if group_by is None:
+                self.cursor.execute(merge)
+                return self.cursor.rowcount
+            # summarize the rows returned by the merge in the database instead of sending them all back
+            self.cursor.execute(f"WITH merged AS ({merge} RETURNING {column_list}) "
+                                f"SELECT {group_by}, COUNT(*) FROM merged GROUP BY {group_by}")
+            groups = self.cursor.fetchall()
+        return sum(group[-1] for group in groups), groups
+
+    def alterTable(self, file_name="alter_query.sql"):
+        # weather_data_partitioned.sql migrates an existing weather_data into one partition per year
+        with open(file_name, 'r') as file:
             # Reads SQL queries from a file and executes them to modify an existing table in the database.
             for line in file.readlines():
                 query = line.strip()
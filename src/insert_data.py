@@ -1,5 +1,6 @@
 # Import in-built libraries
 import os
+import logging
 # Import argument parser library
 import argparse
 # Import python library for postgres sql
@@ -8,8 +9,14 @@ import psycopg2
 import pandas as pd
 import numpy as np
 # Import python classes from python modules
-from data_operations import InsertData
-from analyze import Analysis
+# imported through the src package like the modules they import, so the process has one connection pool and one metrics registry
+from src.data_operations import InsertData
+from src.analyze import Analysis
+from src.columnar import ColumnarSnapshot
+from src.db_conn import Database
+from src.cumulative import CumulativeIndex
+from src.cache import invalidateCache
+from src.metrics import metrics, stageTimer
 
 
 def main():
@@ -19,20 +26,69 @@ def main():
     # Argument for analyzing the whole data and inserting into weather_data_stats table
     parser.add_argument('--analyse_insert', type=bool, required=False, help='get weather data and store the analysis in weather_data_stats table : Boolean')
 
+    parser.add_argument('--use_snapshot', type=bool, required=False, help='analyse the weather data from the local columnar snapshot instead of the database : Boolean')
+    parser.add_argument('--refresh_snapshot', type=bool, required=False, help='rebuild the local columnar snapshot of weather_data after inserting data : Boolean')
     parser.add_argument('--insert_dir_data', type=bool, required=False, help='Inserts weather and yield directory data into Postgres SQL tables : Boolean')
     parser.add_argument('--tbl_name', type=str, required=False, help='pass the table name where the data will be stored')
+    parser.add_argument('--refresh_stats', type=bool, required=False, help='after inserting weather data, recompute weather_data_stats for the years and stations that changed : Boolean')
+    parser.add_argument('--refresh_cumulative', type=bool, required=False, help='rebuild the weather_cumulative prefix sums of every station from weather_data : Boolean')
+    parser.add_argument('--full_reload', type=bool, required=False, help='load every file of the directory even if the ingest manifest says it is unchanged : Boolean')
+    parser.add_argument('--partition_weather_data', type=bool, required=False, help='migrate weather_data into one partition per year before anything else : Boolean')
+    parser.add_argument('--workers', type=int, required=False, help='number of processes used to parse the data files, defaults to the number of cpu cores : Integer')
     # parse command-line arguments
     args = parser.parse_args()  # Create an object to accept input parameters to command line scripts
 
     # call appropriate functions based on command-line arguments
-    if args.analyse_insert:
-        al = Analysis()
-        al.insertStatsData()
+    if args.partition_weather_data:
+        # moves the rows of a plain weather_data into a table partitioned by year, does nothing if already partitioned
+        with Database() as db, stageTimer('partition', 'weather_data'):
+            db.alterTable("weather_data_partitioned.sql")
+        logging.info("[weather_data] is partitioned by year")
 
     if args.insert_dir_data:
         if args.tbl_name:
-            ins = InsertData()
-            ins.insertData(args.tbl_name)
+            ins = InsertData(args.workers)
+            ins.insertData(args.tbl_name, bool(args.full_reload))
+            ins.db.close()
+            if args.refresh_stats and args.tbl_name == ins.weather_table_name:
+                # incremental refresh of the statistics, only for the (year, station_id) groups touched by the load
+                al = Analysis()
+                al.insertStatsData(ins.touched_groups)
+                al.db.close()
+
+    if args.refresh_cumulative:
+        # full rebuild, needed once for weather data loaded before the weather_cumulative table existed
+        with Database() as db, stageTimer('cumulative', 'weather_data'):
+            db.createTable()
+            rows = CumulativeIndex(db).update()
+            db.conn.commit()
+        # cached API responses may contain windows computed from the old prefix sums
+        invalidateCache()
+        logging.info(f"Prefix sums rebuilt with {rows} rows in [weather_cumulative]")
+
+    if args.refresh_snapshot:
+        # dump weather_data into the local columnar snapshot read by the analysis and the stats endpoint
+        with Database() as db, stageTimer('snapshot_build', 'weather_data'):
+            rows = ColumnarSnapshot().build(db)
+        # cached API responses may have been computed from the old snapshot
+        invalidateCache()
+        logging.info(f"Columnar snapshot rebuilt with {rows} rows of [weather_data]")
+
+    if args.analyse_insert:
+        al = Analysis(bool(args.use_snapshot))
+        al.insertStatsData()
+        al.db.close()
+
+    if (args.insert_dir_data and args.tbl_name) or args.analyse_insert:
+        # yield and statistics may have changed, refresh the views served by /api/yield/weather
+        al = Analysis()
+        al.refreshYieldWeather()
+        al.db.close()
+
+    # where the time of this run went, per pipeline stage and per SQL statement
+    summary = metrics.summary()
+    logging.info(f"Timing summary\n{summary}")
+    print(summary)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+import psycopg2.extras
+
+
+def fileDigest(file_path, prefix_size=0):
+    """
+    Hash a file in a single pass, also returning the hash of its first prefix_size bytes.
+    :param file_path: path of the file to hash
+    :param prefix_size: size in bytes of the prefix to hash separately, 0 to skip the prefix hash
+    :return: tuple (prefix hash, full hash, True if the prefix ends with a new line)
+    """
+    digest = hashlib.sha256()
+    prefix_hash = None
+    prefix_ends_line = False
+    remaining = prefix_size
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            if 0 < remaining <= len(chunk):
+                # the prefix ends inside this chunk, snapshot the hash at that position and keep going
+                digest.update(chunk[:remaining])
+                prefix_hash = digest.hexdigest()
+                prefix_ends_line = chunk[remaining - 1:remaining] == b'\n'
+                digest.update(chunk[remaining:])
+            else:
+                digest.update(chunk)
+            remaining -= len(chunk)
+    return prefix_hash, digest.hexdigest(), prefix_ends_line
+
+
+class IngestManifest:
+    def __init__(self, db):
+        """
+        Manifest of the data files already ingested into the database, stored in the ingest_manifest table.
+        For every file it keeps the size, modification time and content hash at the time it was loaded,
+        and for station files the last date loaded, so re-runs only read new or changed files.
+        :param db: Database instance used to read and write the manifest
+        """
+        self.db = db
+        self.fetch_query = "SELECT file_name, file_size, file_mtime, content_hash, last_date FROM ingest_manifest WHERE table_name = %s"
+        self.upsert_query = ("INSERT INTO ingest_manifest (table_name, file_name, file_size, file_mtime, content_hash, last_date, loaded_at) "
+                             "VALUES %s ON CONFLICT (table_name, file_name) DO UPDATE SET file_size = EXCLUDED.file_size, "
+                             "file_mtime = EXCLUDED.file_mtime, content_hash = EXCLUDED.content_hash, "
+                             "last_date = EXCLUDED.last_date, loaded_at = EXCLUDED.loaded_at")
+
+    def plan(self, table_name, directory, files, full_reload=False):
+        """
+        Compare the files on disk with the manifest and decide what needs to be loaded.
+        * unchanged size and mtime: skipped without reading the file
+        * same content with a new mtime: skipped, only the manifest is updated
+        * file grew and the previously loaded content is unchanged: only the appended tail is loaded
+        * anything else (new, truncated or rewritten file): the whole file is loaded
+        :param table_name: table the files are loaded into
+        :param directory: directory containing the files
+        :param files: names of the files currently in the directory
+        :param full_reload: ignore the manifest and load every file
+        :return: tuple (entries to load, entries that are unchanged but need their manifest row refreshed)
+        each entry is a dict with file_name, offset, file_size, file_mtime, content_hash and last_date
+        """
+        self.db.cursor.execute(self.fetch_query, (table_name,))
+        manifest = {row[0]: row[1:] for row in self.db.cursor.fetchall()}
+        to_load, to_touch = [], []
+        for file in files:
+            stat = os.stat(os.path.join(directory, file))
+            entry = {'file_name': file, 'offset': 0, 'file_size': stat.st_size, 'file_mtime': stat.st_mtime, 'last_date': None}
+            stored = None if full_reload else manifest.get(file)
+            if stored is None:
+                entry['content_hash'] = fileDigest(os.path.join(directory, file))[1]
+                to_load.append(entry)
+                continue
+            stored_size, stored_mtime, stored_hash, stored_last_date = stored
+            if stored_size == stat.st_size and stored_mtime == stat.st_mtime:
+                continue
+            grown = stat.st_size > stored_size
+            prefix_hash, entry['content_hash'], prefix_ends_line = fileDigest(os.path.join(directory, file), stored_size if grown else 0)
+            if entry['content_hash'] == stored_hash:
+                entry['last_date'] = stored_last_date
+                to_touch.append(entry)
+            elif grown and prefix_hash == stored_hash and prefix_ends_line:
+                # rows already loaded are untouched, only read what was appended after them
+                entry['offset'] = stored_size
+                entry['last_date'] = stored_last_date
+                to_load.append(entry)
+            else:
+                to_load.append(entry)
+        return to_load, to_touch
+
+    def record(self, table_name, entries):
+        """
+        Store the state of the given files in the manifest. Not committed, so it can be part of the load transaction.
+        :param table_name: table the files were loaded into
+        :param entries: entries returned by plan, with last_date set to the last date loaded for the station
+        :return: None
+        """
+        rows = [(table_name, e['file_name'], e['file_size'], e['file_mtime'], e['content_hash'], e['last_date']) for e in entries]
+        if rows:
+            psycopg2.extras.execute_values(self.db.cursor, self.upsert_query, rows, template="(%s, %s, %s, %s, %s, %s, now())")
@@ -0,0 +1,199 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+
+# upper bounds in seconds of the latency histogram buckets, from a fast index lookup to a full reload
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# first table named by a statement, used to label the SQL timings without putting the whole query in a label
+# a name directly followed by a parenthesis is a function, e.g. FROM unnest(...), and is skipped like JOIN LATERAL (...)
+table_pattern = re.compile(r'\b(?:COPY|FROM|INTO|UPDATE|TABLE|TRUNCATE|JOIN|ON|MATERIALIZED\s+VIEW)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+|CONCURRENTLY\s+)?'
+                           r'(?!LATERAL\b)([A-Za-z_][A-Za-z0-9_.]*)(?![A-Za-z0-9_.(])', re.IGNORECASE)
+# functions taking a FROM in their arguments, e.g. EXTRACT(YEAR FROM date), removed before looking for the table
+function_from_pattern = re.compile(r'\b(?:EXTRACT|SUBSTRING|TRIM|OVERLAY)\s*\([^()]*\)', re.IGNORECASE)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        In process registry of latency histograms and counters, rendered in the Prometheus text format.
+        Every process keeps its own values: the API worker answering /metrics reports its own requests, and the
+        command line scripts print a summary of their run.
+        """
+        self.histograms = {}
+        self.counters = {}
+        self.descriptions = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, metric_type, description):
+        self.descriptions[name] = (metric_type, description)
+
+    def observe(self, name, labels, value):
+        """
+        Record one measurement in the histogram of the given name and labels.
+        :param name: metric name
+        :param labels: dict of label name to value
+        :param value: measured value, in seconds for the latency metrics
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(latency_buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # time the enclosed block, it is recorded even if the block raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def render(self):
+        """
+        :return: all the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            histograms = sorted((key, (list(h.counts), h.count, h.sum, h.buckets)) for key, h in self.histograms.items())
+            counters = sorted(self.counters.items())
+        described = set()
+        for (name, labels), (counts, count, total, buckets) in histograms:
+            if name not in described:
+                lines += self.header(name, 'histogram')
+                described.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{formatLabels(labels + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{formatLabels(labels)} {total}")
+            lines.append(f"{name}_count{formatLabels(labels)} {count}")
+        for (name, labels), value in counters:
+            if name not in described:
+                lines += self.header(name, 'counter')
+                described.add(name)
+            lines.append(f"{name}{formatLabels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def header(self, name, metric_type):
+        metric_type, description = self.descriptions.get(name, (metric_type, name))
+        return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+
+    def summary(self):
+        """
+        :return: human readable table of the timings recorded so far, slowest total first
+        """
+        with self.lock:
+            rows = [(h.sum, name, labels, h.count, h.max) for (name, labels), h in self.histograms.items()]
+            counters = dict(self.counters)
+        lines = [f"{'metric':<80} {'count':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}"]
+        for total, name, labels, count, maximum in sorted(rows, reverse=True):
+            series = f"{name.replace('crop_weather_', '')}{formatLabels(labels)}"
+            if name == 'crop_weather_sql_seconds':
+                series += f" rows={counters.get(('crop_weather_sql_rows_total', labels), 0)}"
+            lines.append(f"{series:<80} {count:>8} {total:>10.3f} {total / count * 1000:>10.2f} {maximum * 1000:>10.2f}")
+        return "\n".join(lines)
+
+
+def escapeLabel(value):
+    # backslash, double quote and line feed are escaped in label values
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escapeLabel(value)}"' for name, value in labels) + "}"
+
+
+# registry of the process, imported as src.metrics like every module of the application so there is one registry
+metrics = MetricsRegistry()
+metrics.describe('crop_weather_stage_seconds', 'histogram', 'Duration of the ingestion and analysis pipeline stages')
+metrics.describe('crop_weather_sql_seconds', 'histogram', 'Duration of the SQL statements executed through the database cursors')
+metrics.describe('crop_weather_sql_rows_total', 'counter', 'Rows returned or affected by the SQL statements')
+metrics.describe('crop_weather_http_request_seconds', 'histogram', 'Latency of the API requests until the response is returned to the server')
+
+
+def stageTimer(stage, table):
+    """
+    Time one stage of the pipeline, e.g. with stageTimer('parse', 'weather_data'): ...
+    :param stage: name of the stage
+    :param table: table the stage works on
+    """
+    return metrics.timer('crop_weather_stage_seconds', stage=stage, table=table)
+
+
+def statementLabels(query):
+    # statement type and first table of a query, e.g. {'statement': 'INSERT', 'table': 'weather_data'}
+    if isinstance(query, bytes):
+        query = query.decode(errors='replace')
+    query = str(query).lstrip()
+    match = table_pattern.search(function_from_pattern.sub('', query))
+    return {'statement': query.split(None, 1)[0].upper() if query else '', 'table': match.group(1) if match else ''}
+
+
+class TimedCursor(extensions.cursor):
+    """
+    Cursor recording the duration and row count of every statement, set as the cursor_factory of the pooled
+    connections so every query of the application is measured.
+    """
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self.record(query, start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self.record(query, start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self.record(sql, start)
+
+    def record(self, query, start):
+        labels = statementLabels(query)
+        metrics.observe('crop_weather_sql_seconds', labels, time.perf_counter() - start)
+        if self.rowcount > 0:
+            metrics.increment('crop_weather_sql_rows_total', labels, self.rowcount)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# value used in the weather data files for a missing measurement
+MISSING_VALUE = -9999
+
+
+def daysToYears(days):
+    """
+    Convert dates stored as the number of days since 1970-01-01 to calendar years, with integer arithmetic only.
+    :param days: numpy integer array of days since 1970-01-01
+    :return: numpy int64 array of years
+    """
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+
+
+def yearlyStationStats(stations, station_codes, days, max_temperature, min_temperature, precipitation_amount):
+    """
+    For every year, for every weather station, calculate the average maximum and minimum temperature in degrees Celsius
+    and the total precipitation in centimeters. Each measurement only ignores its own missing values (-9999), so a
+    missing precipitation does not drop the temperatures of that day.
+    Rows are grouped with a dense (year, station) key and reduced with np.bincount, in linear time.
+    :param stations: sorted array of station ids, station_codes index into it
+    :param station_codes: integer array, position in stations of the station of each row
+    :param days: integer array, date of each row as days since 1970-01-01
+    :param max_temperature: array of maximum temperatures in tenths of degrees Celsius
+    :param min_temperature: array of minimum temperatures in tenths of degrees Celsius
+    :param precipitation_amount: array of precipitation in tenths of millimeters
+    :return: dataframe with the columns year, station_id, max_temperature, min_temperature, precipitation_amount
+        ordered on year and station_id, a metric without any valid value in a group is NaN
+    """
+    columns = ['year', 'station_id', 'max_temperature', 'min_temperature', 'precipitation_amount']
+    if len(days) == 0:
+        return pd.DataFrame(columns=columns)
+    years = daysToYears(days)
+    first_year = int(years.min())
+    station_count = len(stations)
+    group_count = (int(years.max()) - first_year + 1) * station_count
+    # dense group key, ordered on year then station
+    keys = (years - first_year) * station_count + np.asarray(station_codes, dtype=np.int64)
+    metrics = {}
+    valid_any = np.zeros(group_count, dtype=bool)
+    for name, values in (('max_temperature', max_temperature), ('min_temperature', min_temperature), ('precipitation_amount', precipitation_amount)):
+        values = np.asarray(values)
+        valid = values != MISSING_VALUE
+        sums = np.bincount(keys, weights=np.where(valid, values, 0), minlength=group_count)
+        counts = np.bincount(keys, weights=valid, minlength=group_count)
+        metrics[name] = (sums, counts)
+        valid_any |= counts > 0
+    groups = np.flatnonzero(valid_any)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        max_sums, max_counts = metrics['max_temperature']
+        min_sums, min_counts = metrics['min_temperature']
+        precipitation_sums, precipitation_counts = metrics['precipitation_amount']
+        result = pd.DataFrame({
+            'year': groups // station_count + first_year,
+            'station_id': np.asarray(stations, dtype=object)[groups % station_count],
+            # tenths of degrees Celsius to degrees Celsius
+            'max_temperature': max_sums[groups] / max_counts[groups] / 10,
+            'min_temperature': min_sums[groups] / min_counts[groups] / 10,
+            # tenths of millimeters to centimeters, no valid value at all gives NaN instead of 0
+            'precipitation_amount': np.where(precipitation_counts[groups] > 0, precipitation_sums[groups] / 100, np.nan),
+        })
+    return result[columns]
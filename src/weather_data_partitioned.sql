@@ -0,0 +1,4 @@
+CREATE OR REPLACE FUNCTION ensure_yearly_partitions(parent text, first_year integer, last_year integer) RETURNS void LANGUAGE plpgsql AS $$ DECLARE y integer; BEGIN FOR y IN first_year..last_year LOOP IF to_regclass(parent || '_y' || y) IS NULL THEN EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', parent || '_y' || y, parent, make_date(y, 1, 1), make_date(y + 1, 1, 1)); END IF; END LOOP; END $$
+DO $$ DECLARE first_year integer; last_year integer; BEGIN IF to_regclass('weather_data') IS NULL THEN CREATE TABLE weather_data (station_id varchar(100), date DATE, max_temperature integer, min_temperature integer, precipitation_amount integer) PARTITION BY RANGE (date); ELSIF (SELECT relkind FROM pg_class WHERE oid = 'weather_data'::regclass) = 'r' THEN ALTER TABLE weather_data RENAME TO weather_data_unpartitioned; CREATE TABLE weather_data (station_id varchar(100), date DATE, max_temperature integer, min_temperature integer, precipitation_amount integer) PARTITION BY RANGE (date); SELECT EXTRACT(YEAR FROM MIN(date))::integer, EXTRACT(YEAR FROM MAX(date))::integer INTO first_year, last_year FROM weather_data_unpartitioned; IF first_year IS NOT NULL THEN PERFORM ensure_yearly_partitions('weather_data', first_year, last_year); END IF; INSERT INTO weather_data SELECT station_id, date, max_temperature, min_temperature, precipitation_amount FROM weather_data_unpartitioned WHERE date IS NOT NULL ORDER BY date, station_id; DROP TABLE weather_data_unpartitioned; ANALYZE weather_data; END IF; END $$
+CREATE UNIQUE INDEX IF NOT EXISTS weather_data_station_date_key ON weather_data (station_id, date)
+CREATE INDEX IF NOT EXISTS weather_data_date_brin ON weather_data USING brin (date)
\ No newline at end of file
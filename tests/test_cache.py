@@ -0,0 +1,33 @@
+from src import cache
+from src.cache import LocalCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    local = LocalCache(max_entries=2, ttl=60)
+    local.set('a', '1', 0)
+    local.set('b', '2', 0)
+    assert local.get('a', 0) == '1'
+    local.set('c', '3', 0)
+    assert local.get('b', 0) is None
+    assert local.get('a', 0) == '1'
+    assert local.get('c', 0) == '3'
+    assert local.size() == 2
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    local = LocalCache(max_entries=10, ttl=60)
+    local.set('a', '1', 0)
+    now[0] += 59
+    assert local.get('a', 0) == '1'
+    now[0] += 2
+    assert local.get('a', 0) is None
+    assert local.size() == 0
+
+
+def test_new_generation_clears_entries():
+    local = LocalCache(max_entries=10, ttl=60)
+    local.set('a', '1', 0)
+    assert local.get('a', 1) is None
+    assert local.size() == 0
@@ -0,0 +1,37 @@
+import datetime
+
+from src.catalog import first_year_bound, last_year_bound, splitYears, totalPages
+
+
+def test_whole_years():
+    assert splitYears(datetime.date(1990, 1, 1), datetime.date(1992, 12, 31)) == (1990, 1992, [])
+
+
+def test_open_range():
+    assert splitYears(None, None) == (first_year_bound, last_year_bound, [])
+    assert splitYears(datetime.date(1990, 1, 1), None) == (1990, last_year_bound, [])
+
+
+def test_partial_years_at_both_ends():
+    first, last, partial = splitYears(datetime.date(1990, 3, 1), datetime.date(1992, 9, 30))
+    assert (first, last) == (1991, 1991)
+    assert partial == [(datetime.date(1990, 3, 1), datetime.date(1990, 12, 31)), (datetime.date(1992, 1, 1), datetime.date(1992, 9, 30))]
+
+
+def test_range_within_one_year_is_one_partial_range():
+    first, last, partial = splitYears(datetime.date(1990, 3, 1), datetime.date(1990, 9, 30))
+    assert first > last
+    assert partial == [(datetime.date(1990, 3, 1), datetime.date(1990, 9, 30))]
+
+
+def test_open_start_with_partial_end():
+    first, last, partial = splitYears(None, datetime.date(1990, 6, 30))
+    assert (first, last) == (first_year_bound, 1989)
+    assert partial == [(datetime.date(1990, 1, 1), datetime.date(1990, 6, 30))]
+
+
+def test_total_pages():
+    assert totalPages(41, 20) == 3
+    assert totalPages(40, 20) == 2
+    assert totalPages(0, 20) == 0
+    assert totalPages(10, 0) == 0
@@ -0,0 +1,20 @@
+import pytest
+
+from src.data_operations import decodeCursor, encodeCursor
+
+
+def test_cursor_round_trip():
+    cursor = encodeCursor('USC00000001', '1985-03-01')
+    assert decodeCursor(cursor) == ('USC00000001', '1985-03-01')
+
+
+def test_cursor_is_url_safe():
+    cursor = encodeCursor('USC00000001?&=/', '1985-03-01')
+    assert all(character.isalnum() or character in '-_=' for character in cursor)
+    assert decodeCursor(cursor) == ('USC00000001?&=/', '1985-03-01')
+
+
+@pytest.mark.parametrize('cursor', ['not a cursor', '', encodeCursor('USC00000001', '1985-03-01')[:-4] + 'AAAA'])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decodeCursor(cursor)
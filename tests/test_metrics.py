@@ -0,0 +1,40 @@
+from src.metrics import statementLabels
+
+
+def test_copy_labels_the_copied_table():
+    assert statementLabels("COPY weather_data (station_id, date) FROM STDIN") == {'statement': 'COPY', 'table': 'weather_data'}
+    assert statementLabels("COPY (SELECT station_id FROM weather_data ORDER BY station_id) TO STDOUT")['table'] == 'weather_data'
+
+
+def test_create_index_labels_the_indexed_table():
+    assert statementLabels("CREATE UNIQUE INDEX IF NOT EXISTS weather_key ON weather_data (station_id, date)")['table'] == 'weather_data'
+
+
+def test_select_and_insert_label_the_first_table():
+    assert statementLabels("SELECT DISTINCT ON (station_id) date FROM weather_data") == {'statement': 'SELECT', 'table': 'weather_data'}
+    assert statementLabels(b"INSERT INTO weather_data_stats VALUES (%s)") == {'statement': 'INSERT', 'table': 'weather_data_stats'}
+
+
+def test_refresh_materialized_view_labels_the_view():
+    assert statementLabels("REFRESH MATERIALIZED VIEW yield_weather_yearly") == {'statement': 'REFRESH', 'table': 'yield_weather_yearly'}
+    assert statementLabels("REFRESH MATERIALIZED VIEW CONCURRENTLY yield_weather_correlation")['table'] == 'yield_weather_correlation'
+
+
+def test_statement_without_table():
+    assert statementLabels("SELECT 1") == {'statement': 'SELECT', 'table': ''}
+    assert statementLabels("") == {'statement': '', 'table': ''}
+
+
+def test_from_inside_function_arguments_is_not_a_table():
+    query = ("SELECT EXTRACT(YEAR FROM date)::integer AS year, station_id, SUBSTRING(station_id FROM 1 FOR 3) AS network, "
+             "AVG(NULLIF(max_temperature, -9999)) FROM weather_data WHERE 1=1 GROUP BY 1, 2")
+    assert statementLabels(query) == {'statement': 'SELECT', 'table': 'weather_data'}
+
+
+def test_set_returning_functions_are_not_tables():
+    query = ("SELECT g.station_id, g.year, COUNT(*) FROM unnest(%s::integer[], %s::varchar[]) AS g(year, station_id) "
+             "JOIN weather_data w ON w.station_id = g.station_id GROUP BY 1, 2")
+    assert statementLabels(query)['table'] == 'weather_data'
+    query = ("SELECT s.spec, r.* FROM (SELECT spec, station_id FROM unnest(%s::integer[], %s::varchar[]) AS u(spec, station_id)) s "
+             "JOIN LATERAL (SELECT w.date FROM weather_data w WHERE w.station_id = s.station_id LIMIT %s) r ON true")
+    assert statementLabels(query)['table'] == 'weather_data'
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+from src.stats_kernel import yearlyStationStats
+
+
+def referenceStats(df):
+    # per metric pandas groupby, each metric ignoring only its own missing values
+    grouped = df.assign(year=df['date'].dt.year).replace(-9999, np.nan).groupby(['year', 'station_id'])
+    result = pd.DataFrame({
+        'max_temperature': grouped['max_temperature'].mean() / 10,
+        'min_temperature': grouped['min_temperature'].mean() / 10,
+        'precipitation_amount': grouped['precipitation_amount'].sum(min_count=1) / 100,
+    }).reset_index()
+    # a group without any valid value is not returned
+    return result.dropna(subset=['max_temperature', 'min_temperature', 'precipitation_amount'], how='all').reset_index(drop=True)
+
+
+def test_matches_pandas_reference():
+    rng = np.random.default_rng(0)
+    rows = 4000
+    df = pd.DataFrame({
+        'station_id': rng.choice(['USC00000001', 'USC00000002', 'USC00000003'], rows),
+        # years before and after 1970
+        'date': pd.Timestamp('1966-06-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D'),
+        'max_temperature': rng.integers(-300, 400, rows),
+        'min_temperature': rng.integers(-400, 300, rows),
+        'precipitation_amount': rng.integers(0, 500, rows),
+    })
+    for column in ('max_temperature', 'min_temperature', 'precipitation_amount'):
+        df.loc[rng.random(rows) < 0.1, column] = -9999
+    # one station without any valid precipitation, and a year of a station without any valid value
+    df.loc[df['station_id'] == 'USC00000003', 'precipitation_amount'] = -9999
+    df.loc[(df['station_id'] == 'USC00000002') & (df['date'].dt.year == 1968),
+           ['max_temperature', 'min_temperature', 'precipitation_amount']] = -9999
+
+    stations = np.array(sorted(df['station_id'].unique()), dtype=object)
+    codes = np.searchsorted(stations, df['station_id'].to_numpy())
+    days = (df['date'] - pd.Timestamp('1970-01-01')).dt.days.to_numpy()
+    result = yearlyStationStats(stations, codes, days, df['max_temperature'].to_numpy(), df['min_temperature'].to_numpy(),
+                                df['precipitation_amount'].to_numpy())
+
+    expected = referenceStats(df)
+    assert result['precipitation_amount'][result['station_id'] == 'USC00000003'].isna().all()
+    assert not ((result['station_id'] == 'USC00000002') & (result['year'] == 1968)).any()
+    pd.testing.assert_frame_equal(result.reset_index(drop=True), expected, check_dtype=False)
+
+
+def test_empty_input():
+    result = yearlyStationStats(np.array([], dtype=object), [], [], [], [], [])
+    assert result.empty
+    assert list(result.columns) == ['year', 'station_id', 'max_temperature', 'min_temperature', 'precipitation_amount']